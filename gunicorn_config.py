@@ -0,0 +1,31 @@
+# gunicorn -c gunicorn_config.py manage:app
+#
+# For /metrics to add up every worker, export prometheus_multiproc_dir
+# pointing at an empty directory before starting gunicorn.
+
+import os
+
+# The password pool sheds logins with a 503 once PASSWORD_POOL_WORKERS are
+# busy and PASSWORD_POOL_QUEUE_SIZE more wait. That only happens if a
+# worker takes more requests at once than that, so use threaded workers
+# with more threads than the pool holds.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 24))
+
+
+def when_ready(server):
+    pool_holds = (int(os.environ.get('PASSWORD_POOL_WORKERS', 2)) +
+                  int(os.environ.get('PASSWORD_POOL_QUEUE_SIZE', 16)))
+    if server.cfg.worker_class_str != 'gthread' or \
+            server.cfg.threads <= pool_holds:
+        server.log.warning(
+            'Workers take at most %s requests at once, the password pool '
+            'holds %s: logins will queue in gunicorn instead of being shed.',
+            server.cfg.threads, pool_holds)
+
+
+def child_exit(server, worker):
+    # drop the live gauges of a worker that has exited
+    if os.environ.get('prometheus_multiproc_dir'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,11 +1,27 @@
+import asyncio
+import json
+import os
 import unittest
 import coverage
 
-from flask_script import Manager
+from flask_script import Manager, Server
 from flask_migrate import MigrateCommand
 
 from project import create_app, db
+from project.api.bulk import import_users as bulk_import_users
 from project.api.models import User
+from project.bench.calibrate import calibrate, format_results
+from project.bench.endpoints import (
+    compare, run_benchmarks, uncovered_endpoints,
+    format_results as format_bench_results)
+from project.bench.micro import (
+    run_microbenchmarks, format_results as format_micro_results)
+from project.bench.seed import seed_users
+from project.bench.traffic import (
+    load_recording, replay as replay_traffic,
+    format_summary as format_replay_summary)
+from project.indexes import (
+    check_indexes as check_hot_queries, format_results as format_index_results)
 
 COV = coverage.coverage(
     branch=True,
@@ -21,6 +37,9 @@ COV = coverage.coverage(
 app = create_app()
 manager = Manager(app)
 manager.add_command('db', MigrateCommand)
+# threaded, so the password pool sees concurrent logins as it would under
+# gunicorn_config.py
+manager.add_command('runserver', Server(threaded=True))
 
 
 @manager.command
@@ -41,9 +60,15 @@ def test():
     return 1
 
 
-@manager.command
-def seed_db():
-    """Seeds the database."""
+@manager.option('-c', '--count', dest='count', type=int, default=None)
+@manager.option('-b', '--batch', dest='batch', type=int, default=10000)
+@manager.option('--seed', dest='seed', type=int, default=None)
+def seed_db(count, batch, seed):
+    """Seeds the database, with --count N synthetic users if given."""
+    if count:
+        rate = seed_users(count, batch, seed=seed)
+        print('Inserted {} users at {:.0f} rows/s.'.format(count, rate))
+        return
     db.session.add(User(
         username='chris',
         email='chris@example.com',
@@ -71,6 +96,122 @@ def seed_db_admin():
     db.session.commit()
 
 
+@manager.option('path', help='NDJSON file with one user object per line')
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int, default=None)
+def import_users(path, chunk_size):
+    """Bulk imports users from an NDJSON file."""
+    chunk_size = chunk_size or app.config.get('BULK_IMPORT_CHUNK_SIZE')
+    with open(path, 'rb') as lines:
+        report = bulk_import_users(lines, chunk_size)
+    created = 0
+    for result in report:
+        if result['status'] == 'created':
+            created += 1
+        else:
+            print('line {line}: {message}'.format(**result))
+    print('{} created, {} failed.'.format(created, len(report) - created))
+    return 0 if created == len(report) else 1
+
+
+@manager.option('-t', '--target-ms', dest='target_ms', type=float, default=250.0)
+@manager.option('-w', '--workers', dest='workers', type=int, default=1)
+@manager.option('-s', '--samples', dest='samples', type=int, default=5)
+def calibrate_bcrypt(target_ms, workers, samples):
+    """Finds the highest BCRYPT_LOG_ROUNDS within a latency budget."""
+    results, recommended = calibrate(target_ms, workers, samples)
+    print(format_results(results))
+    if recommended is None:
+        print('No cost factor hashes within {} ms on this machine.'.format(
+            target_ms))
+        return 1
+    print('Recommended: export BCRYPT_LOG_ROUNDS={}'.format(recommended))
+    return 0
+
+
+@manager.command
+def check_indexes():
+    """Confirms with EXPLAIN that every hot query is served by an index."""
+    results = check_hot_queries(db.session)
+    print(format_index_results(results))
+    return 0 if all(ok for _, _, ok in results) else 1
+
+
+@manager.option('-u', '--users', dest='users', type=int, default=1000)
+@manager.option('-n', '--requests', dest='requests', type=int, default=100)
+@manager.option('-o', '--output', dest='output', default='bench_results.json')
+@manager.option('-b', '--baseline', dest='baseline', default=None)
+@manager.option('-t', '--threshold', dest='threshold', type=float, default=0.2)
+@manager.option('--database-url', dest='database_url', default=None)
+def bench(users, requests, output, baseline, threshold, database_url):
+    """Benchmarks every endpoint against a freshly seeded scratch database."""
+    bench_app = create_app()
+    # the benchmark drops every table, so never default to DATABASE_URL
+    bench_app.config['SQLALCHEMY_DATABASE_URI'] = (
+        database_url or os.environ.get('BENCH_DATABASE_URL', 'sqlite://'))
+    with bench_app.app_context():
+        for endpoint in uncovered_endpoints(bench_app):
+            print('warning: no benchmark for {}'.format(endpoint))
+        results = run_benchmarks(bench_app, users, requests)
+    print(format_bench_results(results))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results written to {}'.format(output))
+    if not baseline:
+        return 0
+    with open(baseline) as f:
+        regressions = compare(results, json.load(f), threshold)
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    return 1 if regressions else 0
+
+
+@manager.option('-n', '--iterations', dest='iterations', type=int, default=1000)
+@manager.option('-r', '--repeat', dest='repeat', type=int, default=5)
+@manager.option('--bcrypt-iterations', dest='bcrypt_iterations', type=int, default=3)
+@manager.option('-o', '--output', dest='output', default=None)
+@manager.option('-b', '--baseline', dest='baseline', default=None)
+def microbench(iterations, repeat, bcrypt_iterations, output, baseline):
+    """Micro-benchmarks JWT, bcrypt and the authenticate decorator."""
+    bench_app = create_app()
+    bench_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+        'BENCH_DATABASE_URL', 'sqlite://')
+    with bench_app.app_context():
+        results = run_microbenchmarks(
+            bench_app, iterations, repeat, bcrypt_iterations)
+    baseline_results = None
+    if baseline:
+        with open(baseline) as f:
+            baseline_results = json.load(f)
+    print(format_micro_results(results, baseline_results))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Results written to {}'.format(output))
+
+
+@manager.option('path', help='recording written with TRAFFIC_RECORD_FILE')
+@manager.option('-u', '--base-url', dest='base_url', default='http://localhost:5000')
+@manager.option('-c', '--concurrency', dest='concurrency', type=int, default=10)
+@manager.option('-r', '--rate', dest='rate', type=float, default=0.0)
+@manager.option('-n', '--requests', dest='requests', type=int, default=None)
+@manager.option('--admin-email', dest='admin_email', default=None)
+@manager.option('--admin-password', dest='admin_password', default=None)
+@manager.option('-o', '--output', dest='output', default=None)
+def replay(path, base_url, concurrency, rate, requests, admin_email,
+           admin_password, output):
+    """Replays a recorded request mix against a running instance."""
+    entries = load_recording(path)
+    loop = asyncio.get_event_loop()
+    summary, elapsed = loop.run_until_complete(replay_traffic(
+        entries, base_url, concurrency, rate, requests or len(entries),
+        admin_email, admin_password))
+    print(format_replay_summary(summary, elapsed))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print('Results written to {}'.format(output))
+
+
 @manager.command
 def cov():
     """Runs the unit tests with coverage."""
@@ -0,0 +1,37 @@
+"""index users by lower-cased email
+
+Revision ID: 3f1d2c9a7b64
+Revises: 89d4d6b12645
+Create Date: 2026-10-18 18:12:40.519306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1d2c9a7b64'
+down_revision = '89d4d6b12645'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Login and register match emails case-insensitively through this index,
+    # which also keeps two accounts from differing only in case. Existing
+    # ones have to be merged or renamed by hand first; which one to keep is
+    # not ours to guess.
+    duplicates = op.get_bind().execute(
+        'SELECT lower(email), count(*) FROM users '
+        'GROUP BY lower(email) HAVING count(*) > 1').fetchall()
+    if duplicates:
+        raise RuntimeError(
+            'Emails used by more than one account, ignoring case: ' +
+            ', '.join('{} ({} accounts)'.format(email, count)
+                      for email, count in duplicates))
+    op.create_index('ix_users_email_lower', 'users',
+                    [sa.text('lower(email)')], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_users_email_lower', table_name='users')
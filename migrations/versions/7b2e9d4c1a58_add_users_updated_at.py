@@ -0,0 +1,40 @@
+"""add users.updated_at
+
+Revision ID: 7b2e9d4c1a58
+Revises: c4e8a1f05d27
+Create Date: 2026-10-18 20:31:27.660915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2e9d4c1a58'
+down_revision = 'c4e8a1f05d27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE users SET updated_at = created_at')
+    # SQLite cannot alter a column in place, so there the batch copies the
+    # table. The copy is built by reflection, which misses expression
+    # indexes; that one is set aside and made again afterwards.
+    copied = op.get_bind().dialect.name == 'sqlite'
+    if copied:
+        op.drop_index('ix_users_email_lower', table_name='users')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(),
+                              nullable=False)
+    if copied:
+        op.create_index('ix_users_email_lower', 'users',
+                        [sa.text('lower(email)')], unique=True)
+    op.create_index('ix_users_updated_at', 'users', ['updated_at'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_users_updated_at', table_name='users')
+    op.drop_column('users', 'updated_at')
@@ -0,0 +1,27 @@
+"""index users by created_at and id
+
+Revision ID: 89d4d6b12645
+Revises: 5c77aef46301
+Create Date: 2026-10-18 15:05:52.847223
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '89d4d6b12645'
+down_revision = '5c77aef46301'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # GET /users sorts by (created_at DESC, id DESC) and seeks with a row
+    # comparison, reading this index backwards
+    op.create_index('ix_users_created_at_id', 'users',
+                    ['created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_users_created_at_id', table_name='users')
@@ -0,0 +1,33 @@
+"""trigram indexes for user search
+
+Revision ID: c4e8a1f05d27
+Revises: 3f1d2c9a7b64
+Create Date: 2026-10-18 19:40:03.184502
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1f05d27'
+down_revision = '3f1d2c9a7b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # substring matches of GET /users/search; other databases scan instead
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE INDEX ix_users_username_trgm ON users '
+               'USING gin (lower(username) gin_trgm_ops)')
+    op.execute('CREATE INDEX ix_users_email_trgm ON users '
+               'USING gin (lower(email) gin_trgm_ops)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_users_email_trgm', table_name='users')
+    op.drop_index('ix_users_username_trgm', table_name='users')
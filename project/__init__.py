@@ -1,16 +1,33 @@
 import os
 import datetime
 from flask import Flask, jsonify
-from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_bcrypt import Bcrypt
 
+from project.compression import Compression
+from project.api.cache import TokenCache, UserCache
+from project.api.passwords import PasswordPool, PasswordHasher
+from project.api.recorder import TrafficRecorder
+from project.metrics import Metrics
+from project.replicas import ReplicaRouter, RoutingSQLAlchemy
+from project.queries import QueryInspector
+
 
 # instantiate the extensions
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+replicas = ReplicaRouter(db)
 migrate = Migrate()
 bcrypt = Bcrypt()
+token_cache = TokenCache()
+# other workers' invalidations reach the token cache through the user cache
+user_cache = UserCache(on_invalidate=[token_cache.invalidate_user])
+password_pool = PasswordPool()
+passwords = PasswordHasher(bcrypt, password_pool)
+traffic_recorder = TrafficRecorder()
+metrics = Metrics()
+query_inspector = QueryInspector()
+compression = Compression()
 
 def create_app():
 
@@ -20,14 +37,23 @@ def create_app():
     # enable CORS
     CORS(app)
 
+    # after_request hooks run last-registered first, so this one sees the
+    # response every other extension has finished with
+    compression.init_app(app)
+
     # set config
     app_settings = os.getenv('APP_SETTINGS')
     app.config.from_object(app_settings)
 
     # set up extensions
     db.init_app(app)
+    replicas.init_app(app)
     bcrypt.init_app(app)
+    password_pool.init_app(app)
     migrate.init_app(app, db)
+    traffic_recorder.init_app(app)
+    query_inspector.init_app(app)
+    metrics.init_app(app)
 
     # register blueprints
     from project.api.users import users_blueprint
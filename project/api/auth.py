@@ -1,9 +1,14 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 from sqlalchemy import exc, or_
 
+from project.api.conditional import not_modified, user_etag, with_validators
 from project.api.models import User
-from project.api.utils import authenticate
-from project import db, bcrypt
+from project.api.passwords import PasswordPoolBusy
+from project.api.serializers import (
+    STATUS_FIELDS, InvalidFields, parse_fields, user_serializer)
+from project.api.utils import authenticate, current_user, password_pool_busy
+from project import db, passwords, replicas, token_cache, user_cache
+from project.replicas import read_only
 
 
 auth_blueprint = Blueprint('auth', __name__)
@@ -25,7 +30,7 @@ def register_user():
     password = post_data.get('password')
     try:
         user = User.query.filter(
-            or_(User.email == email, User.username == username)).first()
+            or_(User.email_matches(email), User.username == username)).first()
         if not user:
             # add new user to db
             new_user = User(
@@ -35,6 +40,8 @@ def register_user():
             )
             db.session.add(new_user)
             db.session.commit()
+            user_cache.invalidate(new_user.id)
+            replicas.wrote(new_user.id)
             # generate auth token
             auth_token = new_user.encode_auth_token(new_user.id)
             response_object = {
@@ -50,6 +57,8 @@ def register_user():
             }
             return jsonify(response_object), 400
         # handler errors
+    except PasswordPoolBusy:
+        return password_pool_busy()
     except (exc.IntegrityError, ValueError) as e:
         db.session.rollback()
         response_object = {
@@ -73,9 +82,13 @@ def login_user():
     password = post_data.get('password')
     try:
         # fetch the user data
-        user = User.query.filter_by(email=email).first()
-        if user and bcrypt.check_password_hash(user.password, password):
-            auth_token = user.encode_auth_token(user.id)
+        user = User.query.filter(User.email_matches(email)).first()
+        if user and passwords.verify(user.password, password):
+            # a failed upgrade rolls back and expires the row; the id is
+            # all the token needs
+            user_id = user.id
+            upgrade_password_hash(user, password)
+            auth_token = user.encode_auth_token(user_id)
             print(auth_token)
             if auth_token:
                 response_object = {
@@ -90,6 +103,8 @@ def login_user():
                 'message': 'User does not exist.'
             }
             return jsonify(response_object), 404
+    except PasswordPoolBusy:
+        return password_pool_busy()
     except Exception as e:
         print(e)
         response_object = {
@@ -98,6 +113,28 @@ def login_user():
         }
         return jsonify(response_object), 500
 
+def upgrade_password_hash(user, password):
+    # Re-hash with the current scheme and cost while we have the plain text,
+    # so cost changes roll out on login instead of forcing a reset. The
+    # upgrade is best effort and never fails the login itself.
+    if not passwords.needs_rehash(user.password):
+        return
+    user_id = user.id
+    try:
+        user.password = passwords.hash(password)
+        db.session.commit()
+    except PasswordPoolBusy:
+        return
+    except exc.SQLAlchemyError:
+        db.session.rollback()
+        current_app.logger.warning(
+            'Could not upgrade the password hash of user %s', user_id,
+            exc_info=True)
+        return
+    user_cache.invalidate(user_id)
+    replicas.wrote(user_id)
+
+
 @auth_blueprint.route('/auth/logout', methods=['GET'])
 @authenticate
 def logout_user(resp):
@@ -108,18 +145,33 @@ def logout_user(resp):
     return jsonify(response_object), 200
 
 @auth_blueprint.route('/auth/status', methods=['GET'])
+@read_only
 @authenticate
 def get_user_status(resp):
-    user = User.query.filter_by(id=resp).first()
+    try:
+        fields = parse_fields(request.args.get('fields'), STATUS_FIELDS)
+    except InvalidFields:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid fields.'
+        }
+        return jsonify(response_object), 400
+    user = current_user(fields)
+    if user is None:
+        # deleted after its token was cached, maybe by another worker
+        token_cache.invalidate_user(resp)
+        response_object = {
+            'status': 'error',
+            'message': 'Something went wrong. Please contact us.'
+        }
+        return jsonify(response_object), 401
+    etag = user_etag(user, fields)
+    response = not_modified(etag, user.updated_at)
+    if response is not None:
+        return response
     response_object = {
         'status': 'success',
-        'data': {
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'active': user.active,
-            'admin': user.admin,
-            'created_at': user.created_at
-        }
+        'data': user_serializer(fields)(user)
     }
-    return jsonify(response_object), 200
+    return with_validators(
+        jsonify(response_object), etag, user.updated_at), 200
@@ -0,0 +1,155 @@
+# project/api/bulk.py
+
+import datetime
+import json
+
+from flask import current_app
+from sqlalchemy import exc, or_
+
+from project import db, passwords, replicas, user_cache
+from project.api.models import User
+
+# longer values would fail the whole chunk's INSERT on Postgres
+MAX_LENGTHS = {key: User.__table__.c[key].type.length
+               for key in ('username', 'email')}
+
+
+def parse_lines(lines):
+    """Yield (line number, row, error) for each non-blank NDJSON line."""
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None, 'Invalid JSON.'
+            continue
+        if not isinstance(row, dict) or not all(
+                isinstance(row.get(key), str) and row.get(key)
+                for key in ('username', 'email', 'password')):
+            yield number, None, 'Invalid payload.'
+            continue
+        if any(len(row[key]) > length for key, length in MAX_LENGTHS.items()):
+            yield number, None, 'Username or email too long.'
+            continue
+        yield number, row, None
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def existing_keys(usernames, emails):
+    """Usernames and lower-cased emails already taken, in one query."""
+    rows = db.session.query(User.username, User.email).filter(or_(
+        User.username.in_(usernames),
+        db.func.lower(User.email).in_([email.lower() for email in emails])
+    )).all()
+    return ({row.username for row in rows},
+            {row.email.lower() for row in rows})
+
+
+# stay under the bind parameter limits of Postgres (65535) and SQLite (32766)
+MAX_INSERT_PARAMS = 32000
+
+
+def insert_rows(rows):
+    # multi-row INSERTs instead of a statement per user
+    if not rows:
+        return
+    per_statement = max(1, MAX_INSERT_PARAMS // len(rows[0]))
+    for start in range(0, len(rows), per_statement):
+        db.session.execute(User.__table__.insert().values(
+            rows[start:start + per_statement]))
+
+
+def import_users(lines, chunk_size):
+    """Create users from NDJSON lines and report on every line.
+
+    Each chunk of ``chunk_size`` rows costs one uniqueness query, parallel
+    hashing on the password pool, one INSERT, one query for the new ids
+    and one commit. The report is a list of dicts with the line number,
+    its status and a message.
+    """
+    report = []
+    seen_usernames = set()
+    seen_emails = set()
+    for chunk in chunked(parse_lines(lines), chunk_size):
+        candidates = []
+        for number, row, error in chunk:
+            if error:
+                report.append(_result(number, 'error', error))
+            elif (row['username'] in seen_usernames or
+                    row['email'].lower() in seen_emails):
+                report.append(_result(
+                    number, 'error', 'Duplicate user in import.'))
+            else:
+                seen_usernames.add(row['username'])
+                seen_emails.add(row['email'].lower())
+                candidates.append((number, row))
+        if not candidates:
+            continue
+        taken_usernames, taken_emails = existing_keys(
+            [row['username'] for _, row in candidates],
+            [row['email'] for _, row in candidates])
+        new = []
+        for number, row in candidates:
+            if row['username'] in taken_usernames or \
+                    row['email'].lower() in taken_emails:
+                report.append(_result(
+                    number, 'error', 'Sorry. That user already exists.'))
+            else:
+                new.append((number, row))
+        hashes = passwords.hash_many([row['password'] for _, row in new])
+        created_at = datetime.datetime.utcnow()
+        rows = [{
+            'username': row['username'],
+            'email': row['email'],
+            'password': hashed,
+            'active': True,
+            'admin': False,
+            'created_at': created_at,
+            'updated_at': created_at
+        } for (_, row), hashed in zip(new, hashes)]
+        try:
+            insert_rows(rows)
+            new_ids = [user_id for user_id, in db.session.query(User.id).filter(
+                User.username.in_([row['username'] for row in rows]))]
+            db.session.commit()
+        except exc.IntegrityError:
+            # a concurrent writer took one of these; nothing in the chunk
+            # was written, so the rows can simply be sent again
+            db.session.rollback()
+            report.extend(_result(number, 'error', 'Conflict, try again.')
+                          for number, _ in new)
+            continue
+        except exc.SQLAlchemyError:
+            db.session.rollback()
+            current_app.logger.warning(
+                'Could not import lines %s to %s', new[0][0], new[-1][0],
+                exc_info=True)
+            report.extend(_result(number, 'error', 'Could not be saved.')
+                          for number, _ in new)
+            continue
+        # as add_user does: SQLite hands out the ids of deleted rows again
+        for user_id in new_ids:
+            user_cache.invalidate(user_id)
+        replicas.wrote(*new_ids)
+        report.extend(_result(number, 'created', row['email'])
+                      for number, row in new)
+    report.sort(key=lambda result: result['line'])
+    return report
+
+
+def _result(line, status, message):
+    return {'line': line, 'status': status, 'message': message}
@@ -0,0 +1,459 @@
+# project/api/cache.py
+
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import current_app
+
+from project.api.serializers import TIMESTAMPS, UserView
+from project.metrics import (
+    USER_CACHE_EVICTIONS, USER_CACHE_LOOKUPS, USER_LOOKUPS_COALESCED)
+
+
+# What authenticate needs to know about the user behind a token
+Identity = namedtuple('Identity', ['id', 'active', 'admin'])
+
+
+class TokenCache:
+    """Process-local LRU of verified auth tokens and the user flags behind them.
+
+    Entries are keyed by a SHA-256 digest of the token so raw tokens are never
+    kept in memory. An entry lives for TOKEN_CACHE_TTL_SECONDS at most and never
+    past the token's own ``exp`` claim. Each worker process has its own cache;
+    with USER_CACHE_PATH set, UserCache passes on the invalidations published
+    by other workers. Otherwise changes made in another worker can be seen
+    late by up to the TTL.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(auth_token):
+        if isinstance(auth_token, str):
+            auth_token = auth_token.encode()
+        return hashlib.sha256(auth_token).digest()
+
+    def _max_size(self):
+        return current_app.config.get('TOKEN_CACHE_SIZE') or 0
+
+    def get(self, auth_token):
+        if not self._max_size():
+            return None
+        key = self._key(auth_token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            identity, expires_at = entry
+            if expires_at <= time.time():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return identity
+
+    def set(self, auth_token, identity, exp):
+        max_size = self._max_size()
+        if not max_size:
+            return
+        ttl = current_app.config.get('TOKEN_CACHE_TTL_SECONDS') or 0
+        expires_at = min(time.time() + ttl, exp)
+        key = self._key(auth_token)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (identity, expires_at)
+            self._by_user.setdefault(identity.id, set()).add(key)
+            while len(self._entries) > max_size:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id):
+        """Drop every cached token that belongs to ``user_id``."""
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, key):
+        # caller must hold the lock
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[0].id
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
+
+
+def encode_user(user):
+    fields = user._asdict()
+    for field in TIMESTAMPS:
+        fields[field] = fields[field].strftime('%Y-%m-%dT%H:%M:%S.%f')
+    return json.dumps(fields)
+
+
+def decode_user(raw):
+    fields = json.loads(raw)
+    for field in TIMESTAMPS:
+        fields[field] = datetime.datetime.strptime(
+            fields[field], '%Y-%m-%dT%H:%M:%S.%f')
+    return UserView(**fields)
+
+
+class MemoryBackend:
+    """Process-local LRU; ``set`` returns how many entries it evicted.
+
+    ``set`` skips the write, returning 0, when ``guard`` returns false.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at, guard=None):
+        with self._lock:
+            if guard is not None and not guard():
+                return 0
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+            evicted = 0
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class _SQLiteFile:
+    """One SQLite connection per thread and process on a shared file."""
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+
+    def connection(self):
+        # a connection inherited across fork() must not be used
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(self.schema)
+            self._local.connection = connection
+            self._local.pid = pid
+        return self._local.connection
+
+
+class SharedBackend:
+    """Entries in a SQLite file, shared by every worker on the host.
+
+    Eviction drops the entries closest to expiring once the file holds
+    more than ``size`` of them. ``guard`` runs inside the write
+    transaction, so no other worker can write in between.
+    """
+
+    def __init__(self, path, size, dumps=encode_user, loads=decode_user):
+        self.size = size
+        self.dumps = dumps
+        self.loads = loads
+        self._file = _SQLiteFile(
+            path, 'CREATE TABLE IF NOT EXISTS user_cache ('
+            'key INTEGER PRIMARY KEY, value TEXT NOT NULL, '
+            'expires_at REAL NOT NULL)')
+
+    def get(self, key):
+        row = self._file.connection().execute(
+            'SELECT value FROM user_cache WHERE key = ? AND expires_at > ?',
+            (key, time.time())).fetchone()
+        return None if row is None else self.loads(row[0])
+
+    def set(self, key, value, expires_at, guard=None):
+        connection = self._file.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if guard is not None and not guard():
+                connection.execute('ROLLBACK')
+                return 0
+            connection.execute(
+                'INSERT OR REPLACE INTO user_cache VALUES (?, ?, ?)',
+                (key, self.dumps(value), expires_at))
+            overflow = connection.execute(
+                'SELECT count(*) FROM user_cache').fetchone()[0] - self.size
+            evicted = 0
+            if overflow > 0:
+                evicted = connection.execute(
+                    'DELETE FROM user_cache WHERE key IN (SELECT key FROM '
+                    'user_cache ORDER BY expires_at LIMIT ?)',
+                    (overflow,)).rowcount
+            connection.execute('COMMIT')
+            return evicted
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def delete(self, key):
+        self._file.connection().execute(
+            'DELETE FROM user_cache WHERE key = ?', (key,))
+
+    def clear(self):
+        self._file.connection().execute('DELETE FROM user_cache')
+
+
+class NullChannel:
+    """Invalidation channel for a single process: nothing to tell."""
+
+    def publish(self, key):
+        pass
+
+    def poll(self):
+        return ()
+
+    def position(self):
+        return 0
+
+    def invalidated_since(self, key, position):
+        return False
+
+
+class SQLiteChannel:
+    """Broadcast invalidations to every worker through a SQLite file.
+
+    Messages are rows in an append-only table; each worker remembers the
+    last one it has read. Rows older than ``retention`` seconds are
+    dropped, which only matters for a worker that stopped polling.
+    """
+
+    def __init__(self, path, retention=300):
+        self.retention = retention
+        self._file = _SQLiteFile(
+            path, 'CREATE TABLE IF NOT EXISTS user_cache_invalidations ('
+            'seq INTEGER PRIMARY KEY AUTOINCREMENT, key INTEGER NOT NULL, '
+            'sent_at REAL NOT NULL)')
+        self._last = self._file.connection().execute(
+            'SELECT coalesce(max(seq), 0) FROM user_cache_invalidations'
+        ).fetchone()[0]
+
+    def publish(self, key):
+        now = time.time()
+        connection = self._file.connection()
+        connection.execute(
+            'INSERT INTO user_cache_invalidations (key, sent_at) '
+            'VALUES (?, ?)', (key, now))
+        connection.execute(
+            'DELETE FROM user_cache_invalidations WHERE sent_at < ?',
+            (now - self.retention,))
+
+    def poll(self):
+        rows = self._file.connection().execute(
+            'SELECT seq, key FROM user_cache_invalidations WHERE seq > ? '
+            'ORDER BY seq', (self._last,)).fetchall()
+        if rows:
+            self._last = rows[-1][0]
+        return [key for _, key in rows]
+
+    def position(self):
+        """The latest message; pass it to ``invalidated_since`` later."""
+        return self._file.connection().execute(
+            'SELECT coalesce(max(seq), 0) FROM user_cache_invalidations'
+        ).fetchone()[0]
+
+    def invalidated_since(self, key, position):
+        return self._file.connection().execute(
+            'SELECT 1 FROM user_cache_invalidations WHERE key = ? AND seq > ? '
+            'LIMIT 1', (key, position)).fetchone() is not None
+
+
+class UserCache:
+    """Cache of UserView records by id, kept coherent across workers.
+
+    USER_CACHE_BACKEND picks ``memory`` (per process) or ``shared`` (a
+    SQLite file at USER_CACHE_PATH); empty disables the cache. Either
+    backend needs USER_CACHE_PATH, which carries invalidations to the
+    other workers; they apply them at most USER_CACHE_SYNC_SECONDS later.
+
+    A row read before an invalidation of its user is never stored: ``set``
+    takes the channel ``position`` seen before the read and checks it.
+    Every invalidation, local or not, is also passed to ``on_invalidate``
+    callables, even with the cache disabled.
+    """
+
+    def __init__(self, on_invalidate=()):
+        self.on_invalidate = list(on_invalidate)
+        self._configured_as = None
+        self._settings = None
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+
+    def _configured(self):
+        config = current_app.config
+        settings = (config.get('USER_CACHE_BACKEND'),
+                    config.get('USER_CACHE_PATH'),
+                    config.get('USER_CACHE_SIZE'))
+        if settings != self._settings:
+            with self._lock:
+                if settings != self._settings:
+                    self._configured_as = self._build(*settings)
+                    self._settings = settings
+        return self._configured_as
+
+    @staticmethod
+    def _build(backend, path, size):
+        """(store or None, channel) for the given settings."""
+        channel = SQLiteChannel(path) if path else NullChannel()
+        if not backend or not size:
+            return None, channel
+        if not path:
+            # without a channel every worker would keep serving rows that
+            # another worker has changed or deleted
+            raise RuntimeError(
+                'USER_CACHE_BACKEND={} needs USER_CACHE_PATH'.format(backend))
+        if backend == 'shared':
+            return SharedBackend(path, size), channel
+        return MemoryBackend(size), channel
+
+    def sync(self):
+        """Apply the invalidations published since the last sync.
+
+        Polls at most every USER_CACHE_SYNC_SECONDS.
+        """
+        store, channel = self._configured()
+        interval = current_app.config.get('USER_CACHE_SYNC_SECONDS') or 0
+        now = time.monotonic()
+        if now - self._synced_at < interval:
+            return
+        self._synced_at = now
+        for key in channel.poll():
+            if store is not None:
+                store.delete(key)
+            for callback in self.on_invalidate:
+                callback(key)
+
+    def enabled(self):
+        return self._configured()[0] is not None
+
+    def get(self, user_id):
+        store, _ = self._configured()
+        if store is None:
+            return None
+        self.sync()
+        user = store.get(user_id)
+        USER_CACHE_LOOKUPS.labels('hit' if user is not None else 'miss').inc()
+        return user
+
+    def position(self):
+        """Take before reading a user from the database; see ``set``."""
+        store, channel = self._configured()
+        return None if store is None else channel.position()
+
+    def set(self, user, position=None):
+        """Store ``user``, unless it was invalidated after ``position``."""
+        store, channel = self._configured()
+        if store is None:
+            return
+        guard = None
+        if position is not None:
+            def guard():
+                return not channel.invalidated_since(user.id, position)
+        ttl = current_app.config.get('USER_CACHE_TTL_SECONDS') or 0
+        evicted = store.set(user.id, user, time.time() + ttl, guard)
+        if evicted:
+            USER_CACHE_EVICTIONS.inc(evicted)
+
+    def invalidate(self, user_id):
+        """Drop ``user_id`` here and tell the other workers to drop it."""
+        store, channel = self._configured()
+        # publish first: a guarded set that commits before the message is
+        # written still lands before the delete below
+        channel.publish(user_id)
+        if store is not None:
+            store.delete(user_id)
+
+    def clear(self):
+        store, _ = self._configured()
+        if store is not None:
+            store.clear()
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run one call per key at a time; concurrent callers share its outcome.
+
+    Callers arriving while a call for their key is in flight wait for it
+    and get its result, or its exception raised again. A caller that waits
+    longer than ``timeout`` seconds gives up and makes the call itself.
+    Share only results that are safe to use from several threads.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if not call.done.wait(timeout):
+                USER_LOOKUPS_COALESCED.labels('timeout').inc()
+                return fn()
+            USER_LOOKUPS_COALESCED.labels('shared').inc()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
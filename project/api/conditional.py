@@ -0,0 +1,62 @@
+# project/api/conditional.py
+
+import hashlib
+
+from flask import current_app, request
+from sqlalchemy import func
+from werkzeug.http import is_resource_modified
+
+from project import db
+from project.api.models import User
+
+
+def user_etag(user, fields=None):
+    """Strong ETag of one user; changes whenever the row is updated.
+
+    ``fields`` tells apart responses showing other fields of the user.
+    """
+    etag = 'user-{}-{}'.format(
+        user.id, user.updated_at.strftime('%Y%m%d%H%M%S%f'))
+    if fields is not None:
+        etag += '-' + '.'.join(fields)
+    return etag
+
+
+def users_version():
+    """(count, latest updated_at, highest id) of users, in one query.
+
+    Together these change on every insert, update and delete.
+    """
+    return db.session.query(
+        func.count(User.id), func.max(User.updated_at), func.max(User.id)
+    ).one()
+
+
+def users_etag(version, variant):
+    """Strong ETag of a user listing; ``variant`` tells listings apart."""
+    count, last_updated, last_id = version
+    raw = '{}:{}:{}:{}'.format(
+        count, last_updated.isoformat() if last_updated else '', last_id,
+        variant)
+    return 'users-' + hashlib.sha1(raw.encode()).hexdigest()
+
+
+def not_modified(etag, last_modified=None):
+    """A 304 response if the client's copy is current, else None.
+
+    Call it before building the body, so a match costs no serialization.
+    """
+    if is_resource_modified(
+            request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return with_validators(
+        current_app.response_class(status=304), etag, last_modified)
+
+
+def with_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # clients may keep a copy but must revalidate before using it
+    response.cache_control.no_cache = True
+    return response
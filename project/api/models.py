@@ -2,8 +2,11 @@ import datetime
 import jwt
 
 from flask import current_app
+from sqlalchemy import DDL, event
 
-from project import db, bcrypt
+from project import db, passwords
+from project.api.serializers import UserView
+from project.metrics import JWT_LATENCY, timed
 
 class User(db.Model):
     __tablename__ = "users"
@@ -14,14 +17,32 @@ class User(db.Model):
     active = db.Column(db.Boolean(), default=True, nullable=False)
     admin = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False)
+    # bumped on every update; the validator behind the GET endpoints' ETags
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.datetime.utcnow,
+        onupdate=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        # backs the keyset pagination of GET /users
+        db.Index('ix_users_created_at_id', created_at, id),
+        # backs the case-insensitive email lookups of login and register, and
+        # keeps two accounts from differing only in the case of their email
+        db.Index('ix_users_email_lower', db.func.lower(email), unique=True),
+        # max(updated_at) versions the GET /users listing
+        db.Index('ix_users_updated_at', updated_at),
+    )
 
     def __init__(self, username, email, password, created_at=datetime.datetime.utcnow()):
         self.username = username
         self.email = email
-        self.password = bcrypt.generate_password_hash(
-            password, current_app.config.get('BCRYPT_LOG_ROUNDS')).decode()
+        self.password = passwords.hash(password)
         self.created_at = created_at
 
+    @staticmethod
+    def email_matches(email):
+        """Case-insensitive email filter served by ix_users_email_lower."""
+        return db.func.lower(User.email) == db.func.lower(email)
+
     def encode_auth_token(self, user_id):
       """Generate the auth token"""
       try:
@@ -33,7 +54,6 @@ class User(db.Model):
           'sub': user_id
           }
           secret_key = current_app.config.get('SECRET_KEY')
-          print("secret key: {}".format(secret_key))
           if not secret_key:
             print("HEY ASSHOEL REMEMBER TO SET THE SECRET_KEY")
           result = jwt.encode(
@@ -66,11 +86,42 @@ class User(db.Model):
     @staticmethod
     def decode_auth_token(auth_token):
         """Decodes the auth token - ":param auth_token: - :return: integer|string"""
+        payload = User.decode_auth_payload(auth_token)
+        if isinstance(payload, str):
+            return payload
+        return payload['sub']
+
+    @staticmethod
+    @timed(JWT_LATENCY)
+    def decode_auth_payload(auth_token):
+        """Decodes the auth token - ":param auth_token: - :return: dict|string"""
         try:
-            payload = jwt.decode(auth_token, current_app.config.get('SECRET_KEY'))
-            return payload['sub']
+            return jwt.decode(auth_token, current_app.config.get('SECRET_KEY'))
         except jwt.ExpiredSignatureError:
             return 'Signature expired. Please log in again.'
         except jwt.InvalidTokenError:
             return 'Invalid token. Please log in again.'
-        
\ No newline at end of file
+        
+
+
+# GET /users/search matches LIKE '%term%', which only trigram indexes serve.
+# Postgres only; SQLite scans, which is fine for tests.
+for _statement in (
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        'CREATE INDEX ix_users_username_trgm ON users '
+        'USING gin (lower(username) gin_trgm_ops)',
+        'CREATE INDEX ix_users_email_trgm ON users '
+        'USING gin (lower(email) gin_trgm_ops)'):
+    event.listen(User.__table__, 'after_create',
+                 DDL(_statement).execute_if(dialect='postgresql'))
+
+
+# Load these with Query.with_entities to read users without hydrating
+# User objects or fetching password hashes
+USER_VIEW_COLUMNS = tuple(getattr(User, field) for field in UserView._fields)
+
+
+def user_view_columns(*fields):
+    """The columns of ``fields``, in UserView order."""
+    return tuple(column for field, column in
+                 zip(UserView._fields, USER_VIEW_COLUMNS) if field in fields)
@@ -0,0 +1,79 @@
+# project/api/pagination.py
+
+import base64
+import datetime
+import json
+
+from sqlalchemy import tuple_
+
+from project.api.models import User
+
+
+# Newest first, and newest id first among users created at the same instant.
+# Both keys run the same way, so a page can seek with one row comparison.
+USERS_ORDER = (User.created_at.desc(), User.id.desc())
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def pack_cursor(values):
+    """Opaque, URL-safe cursor holding a list of JSON values."""
+    raw = json.dumps(values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def unpack_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+def encode_cursor(created_at, user_id):
+    """Opaque cursor pointing just past the given (created_at, id) key."""
+    return pack_cursor([created_at.isoformat(), user_id])
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, user_id = unpack_cursor(cursor)
+        if '.' not in created_at:
+            created_at += '.000000'
+        created_at = datetime.datetime.strptime(
+            created_at, '%Y-%m-%dT%H:%M:%S.%f')
+        return created_at, int(user_id)
+    except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+def parse_limit(value, default, maximum):
+    if value is None:
+        return default
+    limit = int(value)
+    if limit < 1:
+        raise ValueError(value)
+    return min(limit, maximum)
+
+
+def seek(query, created_at, user_id):
+    """Users after the (created_at, id) key in USERS_ORDER."""
+    return query.filter(
+        tuple_(User.created_at, User.id) < tuple_(created_at, user_id))
+
+
+def users_page(query, limit, cursor=None):
+    # Seek on the (created_at, id) index instead of using OFFSET, so a
+    # deep page costs the same as the first one. One extra row tells us
+    # whether there is a next page.
+    query = query.order_by(*USERS_ORDER)
+    if cursor is not None:
+        query = seek(query, *decode_cursor(cursor))
+    users = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(users[-1].created_at, users[-1].id)
+    return users, next_cursor
@@ -0,0 +1,234 @@
+# project/api/passwords.py
+
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from project.metrics import PASSWORD_LATENCY, timed
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+class PasswordPool:
+    """Bounded worker pool for password hashing and verification.
+
+    bcrypt releases the GIL while it works, so a small thread pool gives real
+    parallelism while capping how much CPU password work may take from the
+    rest of the app. At most PASSWORD_POOL_WORKERS jobs run at once and
+    PASSWORD_POOL_QUEUE_SIZE more may wait; anything past that is rejected
+    straight away with PasswordPoolBusy instead of piling up behind a login
+    storm. Batch work goes through ``submit_bulk``, which keeps it to
+    PASSWORD_POOL_BULK_WORKERS jobs at a time so logins still find room.
+    """
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._slots = None
+        self._bulk_slots = None
+        self.retry_after = 1
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        workers = app.config.get('PASSWORD_POOL_WORKERS')
+        queue_size = app.config.get('PASSWORD_POOL_QUEUE_SIZE')
+        self.retry_after = app.config.get('PASSWORD_POOL_RETRY_AFTER')
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='password')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        bulk_workers = app.config.get('PASSWORD_POOL_BULK_WORKERS')
+        self._bulk_slots = threading.BoundedSemaphore(
+            bulk_workers or max(1, workers // 2))
+
+    def submit(self, fn, *args, block=False):
+        """Queue ``fn(*args)`` and return its future.
+
+        Raises PasswordPoolBusy when the pool is full, unless ``block`` is set,
+        in which case the caller waits for a free slot. Only offline callers
+        such as manage.py commands should block.
+        """
+        if not self._slots.acquire(blocking=block):
+            raise PasswordPoolBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def submit_bulk(self, fn, *args):
+        """Queue ``fn(*args)`` as batch work and return its future.
+
+        Waits while PASSWORD_POOL_BULK_WORKERS batch jobs are in flight, so
+        a batch holds only a share of the workers and of the queue.
+        """
+        self._bulk_slots.acquire()
+        try:
+            future = self.submit(fn, *args, block=True)
+        except Exception:
+            self._bulk_slots.release()
+            raise
+        future.add_done_callback(lambda _: self._bulk_slots.release())
+        return future
+
+    def run(self, fn, *args, block=False):
+        """Run ``fn(*args)`` on the pool and wait for the result."""
+        return self.submit(fn, *args, block=block).result()
+
+
+class BcryptHasher:
+    """bcrypt through Flask-Bcrypt; the cost is read back from the hash."""
+
+    scheme = 'bcrypt'
+    prefixes = ('$2a$', '$2b$', '$2y$')
+
+    def __init__(self, bcrypt, rounds):
+        self.bcrypt = bcrypt
+        self.rounds = rounds
+
+    def hash(self, password):
+        return self.bcrypt.generate_password_hash(
+            password, self.rounds).decode()
+
+    def verify(self, hashed, password):
+        return self.bcrypt.check_password_hash(hashed, password)
+
+    def needs_rehash(self, hashed):
+        return int(hashed.split('$')[2]) != self.rounds
+
+
+class ScryptHasher:
+    """Stdlib scrypt, stored as ``$scrypt$ln=..,r=..,p=..$salt$key``.
+
+    Only usable when the interpreter's OpenSSL provides hashlib.scrypt.
+    """
+
+    scheme = 'scrypt'
+    prefixes = ('$scrypt$',)
+    salt_bytes = 16
+    key_bytes = 32
+
+    def __init__(self, log_n, r, p):
+        self.log_n = log_n
+        self.r = r
+        self.p = p
+
+    @staticmethod
+    def available():
+        return hasattr(hashlib, 'scrypt')
+
+    def _derive(self, password, salt, log_n, r, p):
+        if not password:
+            raise ValueError('Password must be non-empty.')
+        if isinstance(password, str):
+            password = password.encode('utf-8')
+        # scrypt needs 128 * r * N * p bytes; leave headroom above that
+        maxmem = 256 * r * (2 ** log_n) * p
+        return hashlib.scrypt(
+            password, salt=salt, n=2 ** log_n, r=r, p=p,
+            maxmem=maxmem, dklen=self.key_bytes)
+
+    def hash(self, password):
+        salt = os.urandom(self.salt_bytes)
+        key = self._derive(password, salt, self.log_n, self.r, self.p)
+        return '$scrypt$ln={},r={},p={}${}${}'.format(
+            self.log_n, self.r, self.p, _b64encode(salt), _b64encode(key))
+
+    def verify(self, hashed, password):
+        params, salt, key = self._parse(hashed)
+        derived = self._derive(password, salt, *params)
+        return hmac.compare_digest(derived, key)
+
+    def needs_rehash(self, hashed):
+        params, _, _ = self._parse(hashed)
+        return params != (self.log_n, self.r, self.p)
+
+    @staticmethod
+    def _parse(hashed):
+        _, _, params, salt, key = hashed.split('$')
+        values = dict(item.split('=') for item in params.split(','))
+        params = (int(values['ln']), int(values['r']), int(values['p']))
+        return params, _b64decode(salt), _b64decode(key)
+
+
+def _b64encode(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+class PasswordHasher:
+    """Hashes new passwords with PASSWORD_SCHEME and verifies any known one.
+
+    The scheme of a stored hash is taken from its prefix, so hashes made
+    with an older scheme or cost keep working. ``needs_rehash`` tells the
+    login path when to upgrade a hash to the current settings. All hashing
+    runs on the password pool.
+    """
+
+    def __init__(self, bcrypt, pool):
+        self.bcrypt = bcrypt
+        self.pool = pool
+
+    def _hashers(self):
+        config = current_app.config
+        hashers = [BcryptHasher(self.bcrypt, config.get('BCRYPT_LOG_ROUNDS'))]
+        if ScryptHasher.available():
+            hashers.append(ScryptHasher(
+                config.get('SCRYPT_LOG_N'),
+                config.get('SCRYPT_R'),
+                config.get('SCRYPT_P')))
+        return hashers
+
+    def _default(self):
+        scheme = current_app.config.get('PASSWORD_SCHEME')
+        for hasher in self._hashers():
+            if hasher.scheme == scheme:
+                return hasher
+        raise RuntimeError(
+            'Password scheme {!r} is not available.'.format(scheme))
+
+    def _identify(self, hashed):
+        for hasher in self._hashers():
+            if hashed.startswith(hasher.prefixes):
+                return hasher
+        return None
+
+    def hash(self, password, block=False):
+        hash_password = timed(PASSWORD_LATENCY.labels('hash'))(
+            self._default().hash)
+        return self.pool.run(hash_password, password, block=block)
+
+    def hash_many(self, plain_passwords):
+        """Hash a batch on the pool's bulk share, waiting for it as needed."""
+        hash_password = timed(PASSWORD_LATENCY.labels('hash'))(
+            self._default().hash)
+        futures = [self.pool.submit_bulk(hash_password, password)
+                   for password in plain_passwords]
+        return [future.result() for future in futures]
+
+    def verify(self, hashed, password, block=False):
+        hasher = self._identify(hashed)
+        if hasher is None:
+            return False
+        verify_password = timed(PASSWORD_LATENCY.labels('verify'))(
+            hasher.verify)
+        return self.pool.run(verify_password, hashed, password, block=block)
+
+    def needs_rehash(self, hashed):
+        default = self._default()
+        if not hashed.startswith(default.prefixes):
+            return True
+        return default.needs_rehash(hashed)
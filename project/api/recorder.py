@@ -0,0 +1,62 @@
+# project/api/recorder.py
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, request
+
+
+def body_shape(data):
+    """Field names and value types of a JSON object, never its values."""
+    if isinstance(data, dict):
+        return OrderedDict(
+            (key, type(value).__name__) for key, value in data.items())
+    return None
+
+
+class TrafficRecorder:
+    """Append the shape of every request to TRAFFIC_RECORD_FILE as NDJSON.
+
+    Only the route, query keys, body field types and the acting user are
+    written down; no values, passwords or tokens leave the request. Does
+    nothing unless TRAFFIC_RECORD_FILE is set.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self._record)
+
+    def _record(self, response):
+        path = current_app.config.get('TRAFFIC_RECORD_FILE')
+        if not path or request.url_rule is None:
+            return response
+        identity = g.get('identity')
+        entry = OrderedDict([
+            ('time', time.time()),
+            ('method', request.method),
+            ('rule', request.url_rule.rule),
+            ('view_args', request.view_args),
+            ('query', sorted(request.args.keys())),
+            ('body', self._body(request)),
+            ('auth_user', identity.id if identity else None),
+            ('auth_admin', identity.admin if identity else False),
+            ('status', response.status_code),
+        ])
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            with open(path, 'a') as f:
+                f.write(line)
+        return response
+
+    @staticmethod
+    def _body(req):
+        if req.mimetype == 'application/x-ndjson':
+            # the view has already consumed the stream; keep its size only
+            return {'ndjson_bytes': req.content_length or 0}
+        return body_shape(req.get_json(silent=True))
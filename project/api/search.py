@@ -0,0 +1,113 @@
+# project/api/search.py
+
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import and_, case, exc, func, or_
+
+from project import db
+from project.api.models import USER_VIEW_COLUMNS, User
+from project.api.pagination import InvalidCursor, pack_cursor, unpack_cursor
+from project.api.serializers import UserView
+
+
+MAX_TERM_LENGTH = 64
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def like_escape(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _like(column, pattern):
+    return func.lower(column).like(pattern, escape='\\')
+
+
+def search_rank(term):
+    """0 for an exact match, 1 and 2 for username and email prefixes, else 3."""
+    prefix = like_escape(term) + '%'
+    return case([
+        (or_(func.lower(User.username) == term,
+             func.lower(User.email) == term), 0),
+        (_like(User.username, prefix), 1),
+        (_like(User.email, prefix), 2),
+    ], else_=3)
+
+
+def search_query(term, limit, cursor=None, min_substring=3):
+    """Users matching ``term``, best matches first, one page at a time.
+
+    Terms shorter than ``min_substring`` only match prefixes: a shorter
+    substring has no trigram to look up and would scan every row.
+    """
+    term = term.strip().lower()
+    if not term or len(term) > MAX_TERM_LENGTH:
+        raise ValueError(term)
+    pattern = like_escape(term) + '%'
+    if len(term) >= min_substring:
+        pattern = '%' + pattern
+    rank = search_rank(term)
+    query = db.session.query(
+        *USER_VIEW_COLUMNS + (rank.label('rank'),)).filter(or_(
+        _like(User.username, pattern), _like(User.email, pattern)))
+    if cursor is not None:
+        after = unpack_cursor(cursor)
+        if not (isinstance(after, list) and len(after) == 2 and
+                isinstance(after[0], int) and isinstance(after[1], str)):
+            raise InvalidCursor(cursor)
+        query = query.filter(or_(
+            rank > after[0],
+            and_(rank == after[0], User.username > after[1])))
+    return query.order_by(rank, User.username).limit(limit + 1)
+
+
+@contextmanager
+def time_limit(session, milliseconds):
+    """Cancel statements in the block that run past ``milliseconds``.
+
+    Raises SearchTimeout; roll the session back before using it again.
+    """
+    connection = session.connection(mapper=User.__mapper__)
+    dialect = connection.dialect.name
+    if not milliseconds or dialect not in ('postgresql', 'sqlite'):
+        yield
+        return
+    if dialect == 'postgresql':
+        # SET LOCAL ends with the transaction, so it is safe behind PgBouncer
+        connection.execute(
+            'SET LOCAL statement_timeout = {:d}'.format(int(milliseconds)))
+        try:
+            yield
+        except exc.OperationalError as e:
+            if getattr(e.orig, 'pgcode', None) == '57014':
+                raise SearchTimeout()
+            raise
+        connection.execute('SET LOCAL statement_timeout = DEFAULT')
+        return
+    deadline = time.perf_counter() + milliseconds / 1000.0
+    raw = connection.connection
+    # SQLite calls this every 1000 instructions and aborts once it is true
+    raw.set_progress_handler(lambda: time.perf_counter() > deadline, 1000)
+    try:
+        yield
+    except exc.OperationalError:
+        if time.perf_counter() > deadline:
+            raise SearchTimeout()
+        raise
+    finally:
+        raw.set_progress_handler(None, 1000)
+
+
+def find_users(term, limit, cursor=None, min_substring=3, timeout_ms=None):
+    """A page of matching users and the cursor of the next page."""
+    query = search_query(term, limit, cursor, min_substring)
+    with time_limit(db.session, timeout_ms):
+        rows = query.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = pack_cursor([rows[-1].rank, rows[-1].username])
+    return [UserView._make(row[:-1]) for row in rows], next_cursor
@@ -0,0 +1,58 @@
+# project/api/serializers.py
+
+from collections import namedtuple
+from functools import lru_cache
+
+from werkzeug.http import http_date
+
+
+# What the read paths need from a user; never the password hash
+UserView = namedtuple('UserView', [
+    'id', 'username', 'email', 'active', 'admin', 'created_at', 'updated_at'])
+
+TIMESTAMPS = ('created_at', 'updated_at')
+
+# the fields each response shows
+LIST_FIELDS = ('id', 'username', 'email', 'created_at')
+SINGLE_FIELDS = ('username', 'email', 'created_at')
+STATUS_FIELDS = ('id', 'username', 'email', 'active', 'admin', 'created_at')
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def parse_fields(value, allowed):
+    """The fields a ``?fields=a,b`` parameter picks from ``allowed``.
+
+    They come back in ``allowed`` order, so equal selections serialize
+    alike; no parameter picks them all.
+    """
+    if value is None:
+        return allowed
+    wanted = {field.strip() for field in value.split(',')}
+    if not wanted <= set(allowed):
+        raise InvalidFields(value)
+    return tuple(field for field in allowed if field in wanted)
+
+
+@lru_cache(maxsize=64)
+def user_serializer(fields):
+    """A function turning a UserView into a JSON-ready dict of ``fields``.
+
+    Rows selected with some of the UserView columns work as well, as long
+    as they include ``fields``.
+
+    Datetimes are formatted here as jsonify would, so the encoder only
+    ever sees strings, numbers and booleans.
+    """
+    plain = tuple(field for field in fields if field not in TIMESTAMPS)
+    timestamps = tuple(field for field in fields if field in TIMESTAMPS)
+
+    def serialize(user):
+        data = {field: getattr(user, field) for field in plain}
+        for field in timestamps:
+            data[field] = http_date(getattr(user, field))
+        return data
+
+    return serialize
@@ -1,13 +1,39 @@
-from flask import Blueprint, jsonify, request, render_template
+from flask import (
+    Blueprint, jsonify, request, render_template, current_app, json,
+    Response, stream_with_context)
 from sqlalchemy import exc
 
-from project.api.models import User
-from project.api.utils import is_admin, authenticate
-from project import db
+from project.api.bulk import import_users
+from project.api.conditional import (
+    not_modified, user_etag, users_etag, users_version, with_validators)
+from project.api.models import User, user_view_columns
+from project.api.pagination import (
+    USERS_ORDER, InvalidCursor, parse_limit, users_page)
+from project.api.passwords import PasswordPoolBusy
+from project.api.search import SearchTimeout, find_users
+from project.api.serializers import (
+    LIST_FIELDS, SINGLE_FIELDS, InvalidFields, parse_fields, user_serializer)
+from project.api.utils import (
+    is_admin, authenticate, get_user, password_pool_busy)
+from project import db, replicas, token_cache, user_cache
+from project.replicas import read_only
 
 users_blueprint = Blueprint('users', __name__, template_folder='./templates')
 auth_blueprint = Blueprint('auth', __name__)
 
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+INVALID_FIELDS = {
+    'status': 'fail',
+    'message': 'Invalid fields.'
+}
+
+BULK_TOO_LARGE = {
+    'status': 'fail',
+    'message': 'Too many users for one request. '
+               'Import them with `manage.py import_users` instead.'
+}
+
 
 @users_blueprint.route('/ping', methods=['GET'])
 def ping_pong():
@@ -37,10 +63,16 @@ def add_user(resp):
     email = post_data.get('email')
     password = post_data.get('password')
     try:
-        user = User.query.filter_by(email=email).first()
+        user = User.query.filter(User.email_matches(email)).first()
         if not user:
-            db.session.add(User(username=username, email=email, password=password))
+            new_user = User(username=username, email=email, password=password)
+            db.session.add(new_user)
+            db.session.flush()
+            new_user_id = new_user.id
             db.session.commit()
+            # SQLite hands out the ids of deleted rows again
+            user_cache.invalidate(new_user_id)
+            replicas.wrote(resp)
             response_object = {
                 'status': 'success',
                 'message': f'{email} was added!'
@@ -52,6 +84,8 @@ def add_user(resp):
                 'message': 'Sorry. That email already exists.'
             }
             return jsonify(response_object), 400
+    except PasswordPoolBusy:
+        return password_pool_busy()
     except exc.IntegrityError as e:
         db.session.rollback()
         response_object = {
@@ -68,32 +102,80 @@ def add_user(resp):
         return jsonify(response_object), 400
 
 
+@users_blueprint.route('/users/bulk', methods=['POST'])
+@authenticate
+def bulk_add_users(resp):
+    """Create users from an NDJSON body, one user object per line."""
+    if not is_admin(resp):
+        response_object = {
+            'status': 'error',
+            'message': 'You do not have permission to do that.'
+        }
+        return jsonify(response_object), 401
+    config = current_app.config
+    # hashing is slow on purpose; big batches belong to the offline command
+    max_bytes = config.get('BULK_IMPORT_MAX_BYTES')
+    body = request.stream.read(max_bytes + 1)
+    if len(body) > max_bytes:
+        return jsonify(BULK_TOO_LARGE), 413
+    lines = body.splitlines()
+    if sum(1 for line in lines if line.strip()) > \
+            config.get('BULK_IMPORT_MAX_ROWS'):
+        return jsonify(BULK_TOO_LARGE), 413
+    report = import_users(lines, config.get('BULK_IMPORT_CHUNK_SIZE'))
+    if not report:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid payload.'
+        }
+        return jsonify(response_object), 400
+    created = sum(1 for result in report if result['status'] == 'created')
+    if created:
+        replicas.wrote(resp)
+    response_object = {
+        'status': 'success',
+        'data': {
+            'created': created,
+            'failed': len(report) - created,
+            'results': report
+        }
+    }
+    return jsonify(response_object), 200
+
+
 @users_blueprint.route('/users/<user_id>', methods=['GET'])
+@read_only
 def get_single_user(user_id):
     """Get single user details."""
+    try:
+        fields = parse_fields(request.args.get('fields'), SINGLE_FIELDS)
+    except InvalidFields:
+        return jsonify(INVALID_FIELDS), 400
     response_object = {
         'status': 'fail',
         'message': 'User does not exist'
     }
     try:
-        user = User.query.filter_by(id=int(user_id)).first()
+        user = get_user(int(user_id), fields)
         if not user:
             return jsonify(response_object), 404
         else:
+            etag = user_etag(user, fields)
+            response = not_modified(etag, user.updated_at)
+            if response is not None:
+                return response
             response_object = {
                 'status': 'success',
-                'data': {
-                    'username': user.username,
-                    'email': user.email,
-                    'created_at': user.created_at
-                }
+                'data': user_serializer(fields)(user)
             }
-            return jsonify(response_object), 200
+            return with_validators(
+                jsonify(response_object), etag, user.updated_at), 200
     except ValueError:
         return jsonify(response_object), 404
 
 
 @users_blueprint.route('/users', methods=['GET'])
+@read_only
 @authenticate
 def get_all_users(resp):
     """Get all users."""
@@ -104,25 +186,143 @@ def get_all_users(resp):
             'message': 'You do not have permissions to delete users.'
         }
         return jsonify(response_object), 401
-    users = User.query.order_by(User.created_at.desc()).all()
-    users_list = []
-    for user in users:
-        user_object = {
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'created_at': user.created_at
-        }
-        users_list.append(user_object)
+    try:
+        fields = parse_fields(request.args.get('fields'), LIST_FIELDS)
+    except InvalidFields:
+        return jsonify(INVALID_FIELDS), 400
+    stream = wants_user_stream()
+    # One aggregate query decides whether the listing changed at all. No
+    # Last-Modified: max(updated_at) stays put when a user is deleted.
+    version = users_version()
+    etag = users_etag(version, (request.query_string, stream))
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    if stream:
+        return with_validators(stream_all_users(fields), etag)
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    next_cursor = None
+    if limit is None and cursor is None:
+        users = User.query.with_entities(
+            *user_view_columns(*fields)).order_by(*USERS_ORDER).all()
+    else:
+        try:
+            limit = parse_limit(
+                limit,
+                current_app.config.get('USERS_PAGE_DEFAULT_LIMIT'),
+                current_app.config.get('USERS_PAGE_MAX_LIMIT'))
+            # the next cursor is made of the last row's sort key
+            users, next_cursor = users_page(
+                User.query.with_entities(*user_view_columns(
+                    'created_at', 'id', *fields)), limit, cursor)
+        except InvalidCursor:
+            response_object = {
+                'status': 'fail',
+                'message': 'Invalid cursor.'
+            }
+            return jsonify(response_object), 400
+        except ValueError:
+            response_object = {
+                'status': 'fail',
+                'message': 'Invalid limit.'
+            }
+            return jsonify(response_object), 400
+    serialize = user_serializer(fields)
+    users_list = [serialize(user) for user in users]
+    response_object = {
+        'status': 'success',
+        'data': {
+            'users': users_list,
+            'next_cursor': next_cursor
+        }
+    }
+    return with_validators(jsonify(response_object), etag), 200
+
+
+@users_blueprint.route('/users/search', methods=['GET'])
+@read_only
+@authenticate
+def search_users(resp):
+    """Find users by username or email prefix or substring."""
+    if not is_admin(resp):
+        response_object = {
+            'status': 'error',
+            'message': 'You do not have permission to do that.'
+        }
+        return jsonify(response_object), 401
+    try:
+        limit = parse_limit(
+            request.args.get('limit'),
+            current_app.config.get('USERS_SEARCH_DEFAULT_LIMIT'),
+            current_app.config.get('USERS_SEARCH_MAX_LIMIT'))
+    except ValueError:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid limit.'
+        }
+        return jsonify(response_object), 400
+    try:
+        users, next_cursor = find_users(
+            request.args.get('q', ''), limit, request.args.get('cursor'),
+            current_app.config.get('USERS_SEARCH_MIN_SUBSTRING'),
+            current_app.config.get('USERS_SEARCH_TIMEOUT_MS'))
+    except InvalidCursor:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid cursor.'
+        }
+        return jsonify(response_object), 400
+    except ValueError:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid search.'
+        }
+        return jsonify(response_object), 400
+    except SearchTimeout:
+        db.session.rollback()
+        response_object = {
+            'status': 'fail',
+            'message': 'Search took too long. Try a longer query.'
+        }
+        return jsonify(response_object), 503
     response_object = {
         'status': 'success',
         'data': {
-            'users': users_list
+            'users': list(map(user_serializer(LIST_FIELDS), users)),
+            'next_cursor': next_cursor
         }
     }
     return jsonify(response_object), 200
 
 
+def wants_user_stream():
+    if request.args.get('stream') == '1':
+        return True
+    best = request.accept_mimetypes.best_match(
+        ['application/json', NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def stream_all_users(fields=LIST_FIELDS):
+    """Stream ``fields`` of every user as one JSON document per line.
+
+    Rows are read through a server-side cursor in batches of
+    USERS_STREAM_BATCH_SIZE and written out as they arrive, so memory use
+    does not grow with the size of the table.
+    """
+    query = User.query.with_entities(*user_view_columns(*fields)).order_by(
+        *USERS_ORDER).yield_per(
+            current_app.config.get('USERS_STREAM_BATCH_SIZE'))
+    serialize = user_serializer(fields)
+
+    def generate():
+        for row in query:
+            yield json.dumps(serialize(row)) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
 #@users_blueprint.route('/users/<user_id>', methods=['DELETE'])
 #@authenticate
 @users_blueprint.route('/users/<user_id>', methods=['DELETE'])
@@ -152,6 +352,9 @@ def delete_user(resp, user_id):
         else:
             db.session.delete(user)
             db.session.commit()
+            token_cache.invalidate_user(user.id)
+            user_cache.invalidate(user.id)
+            replicas.wrote(resp)
             response_object = {
                 'status': 'success',
                 'message': 'User {} has been deleted.'.format(user.username)
@@ -231,6 +434,9 @@ def modify_user(resp, user_id):
                     user.email = new_email
                     response_object['message'] += ' email'
                 db.session.commit()
+                token_cache.invalidate_user(user.id)
+                user_cache.invalidate(user.id)
+                replicas.wrote(resp, user.id)
                 return jsonify(response_object), 200
     except exc.IntegrityError as e:
         db.session.rollback()
@@ -2,9 +2,15 @@
 
 from functools import wraps
 
-from flask import request, jsonify
+from flask import current_app, request, jsonify, g
 
-from project.api.models import User
+from project import token_cache, password_pool, replicas, user_cache
+from project.api.cache import Identity, SingleFlight
+from project.api.models import USER_VIEW_COLUMNS, User, user_view_columns
+from project.api.serializers import UserView
+
+
+user_lookups = SingleFlight()
 
 
 def authenticate(f):
@@ -23,17 +29,108 @@ def authenticate(f):
             code = 403
             return jsonify(response_object), code
         auth_token = auth_header.split(' ')[1]
-        resp = User.decode_auth_token(auth_token)
-        if isinstance(resp, str):
-            response_object['message'] = resp
+        # drops cached tokens of users changed or deleted by other workers
+        user_cache.sync()
+        # a cached token has already been verified and carries the user flags,
+        # so it needs neither the signature check nor a database round trip
+        identity = token_cache.get(auth_token)
+        # g outlives the request when an app context was already pushed
+        g.pop('current_user', None)
+        if identity is None:
+            payload = User.decode_auth_payload(auth_token)
+            if isinstance(payload, str):
+                response_object['message'] = payload
+                return jsonify(response_object), code
+            with replicas.reads(payload['sub']):
+                user = load_current_user(payload['sub'])
+            if not user:
+                return jsonify(response_object), code
+            identity = Identity(user.id, user.active, user.admin)
+            token_cache.set(auth_token, identity, payload['exp'])
+        g.identity = identity
+        if not identity.active:
             return jsonify(response_object), code
-        user = User.query.filter_by(id=resp).first()
-        if not user or not user.active:
-            return jsonify(response_object), code
-        return f(resp, *args, **kwargs)
+        return f(identity.id, *args, **kwargs)
     return decorated_function
 
 
+def get_user(user_id, fields=None):
+    """The user with ``user_id`` as a UserView, or None if there is none.
+
+    Lookups go through the user cache, and concurrent misses for the same
+    user share one query. Users written in the last few seconds are not
+    cached, as their row may have come from a lagging replica.
+
+    With the cache off, ``fields`` limits the query to those columns plus
+    id and updated_at, and a row with just them is returned instead.
+    """
+    cached = user_cache.enabled()
+    if cached:
+        user = user_cache.get(user_id)
+        if user is not None:
+            return user
+        # the cache keeps whole users
+        fields = None
+    # a read from the primary must not be answered by a replica read
+    key = (user_id, replicas.engine_for_read() is not None, fields)
+    position, user = user_lookups.do(
+        key, lambda: _load_user(user_id, fields),
+        current_app.config.get('USER_LOOKUP_WAIT_SECONDS'))
+    if cached and user is not None and not replicas.wrote_recently(user_id):
+        user_cache.set(user, position)
+    return user
+
+
+def _load_user(user_id, fields=None):
+    # taken before the query, so a change committed meanwhile is noticed
+    position = user_cache.position()
+    if fields is None:
+        columns = USER_VIEW_COLUMNS
+    else:
+        columns = user_view_columns('id', 'updated_at', *fields)
+    row = User.query.with_entities(*columns).filter(
+        User.id == user_id).first()
+    if row is None or fields is not None:
+        return position, row
+    return position, UserView._make(row)
+
+
+def load_current_user(user_id):
+    # Load the authenticated user once and keep it on the request context so
+    # is_admin and the views don't have to query for the same row again
+    user = get_user(user_id)
+    g.current_user = user
+    return user
+
+
+def current_user(fields=None):
+    # The row is only fetched on a token cache hit when a view actually needs
+    # it. A row of just ``fields`` is not kept for the rest of the request.
+    if 'current_user' not in g:
+        identity = g.get('identity')
+        if identity is None:
+            return None
+        if fields is not None:
+            return get_user(identity.id, fields)
+        return load_current_user(identity.id)
+    return g.current_user
+
+
 def is_admin(user_id):
-    user = User.query.filter_by(id=user_id).first()
-    return user.admin
\ No newline at end of file
+    identity = g.get('identity')
+    if identity is not None and identity.id == user_id:
+        return identity.admin
+    user = get_user(user_id)
+    return user is not None and user.admin
+
+
+def password_pool_busy():
+    # Shed load instead of queueing more password work behind a full pool
+    response_object = {
+        'status': 'error',
+        'message': 'Too many requests. Please try again shortly.'
+    }
+    response = jsonify(response_object)
+    response.status_code = 503
+    response.headers['Retry-After'] = str(password_pool.retry_after)
+    return response
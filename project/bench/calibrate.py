@@ -0,0 +1,76 @@
+# project/bench/calibrate.py
+
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from project import bcrypt
+
+
+RoundsResult = namedtuple(
+    'RoundsResult',
+    ['rounds', 'single_ms', 'loaded_p50_ms', 'loaded_p95_ms', 'hashes_per_sec'])
+
+MIN_ROUNDS = 4
+MAX_ROUNDS = 16
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def time_hash(rounds, password='calibrate-bcrypt'):
+    start = time.perf_counter()
+    bcrypt.generate_password_hash(password, rounds)
+    return (time.perf_counter() - start) * 1000
+
+
+def measure_rounds(rounds, workers, samples):
+    single = [time_hash(rounds) for _ in range(samples)]
+    # under load: keep every worker busy and time each hash individually
+    count = workers * samples
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        loaded = list(executor.map(time_hash, [rounds] * count))
+    elapsed = time.perf_counter() - start
+    return RoundsResult(
+        rounds=rounds,
+        single_ms=percentile(single, 50),
+        loaded_p50_ms=percentile(loaded, 50),
+        loaded_p95_ms=percentile(loaded, 95),
+        hashes_per_sec=count / elapsed)
+
+
+def calibrate(target_ms, workers=1, samples=5,
+              rounds=range(MIN_ROUNDS, MAX_ROUNDS + 1)):
+    """Benchmark each bcrypt cost and pick the highest one within budget.
+
+    A cost is within budget when its p95 latency with ``workers`` hashes
+    running at once stays under ``target_ms``. Returns the measurements and
+    the recommended round count (None if even the cheapest is too slow).
+    """
+    results = []
+    recommended = None
+    for cost in rounds:
+        result = measure_rounds(cost, workers, samples)
+        results.append(result)
+        if result.loaded_p95_ms <= target_ms:
+            recommended = cost
+        else:
+            # every extra round doubles the work; nothing past here will fit
+            break
+    return results, recommended
+
+
+def format_results(results):
+    lines = ['{:>6} {:>10} {:>12} {:>12} {:>10}'.format(
+        'rounds', 'single ms', 'loaded p50', 'loaded p95', 'hashes/s')]
+    for r in results:
+        lines.append('{:>6} {:>10.1f} {:>12.1f} {:>12.1f} {:>10.1f}'.format(
+            r.rounds, r.single_ms, r.loaded_p50_ms, r.loaded_p95_ms,
+            r.hashes_per_sec))
+    return '\n'.join(lines)
@@ -0,0 +1,244 @@
+# project/bench/endpoints.py
+
+import json
+import time
+from collections import OrderedDict
+
+from project import db, token_cache, user_cache
+from project.api.models import User
+from project.bench.calibrate import percentile
+from project.bench.seed import seed_users
+from project.queries import QueryCounter
+
+
+BENCH_PASSWORD = 'benchmark'
+
+
+class BenchContext:
+    """Users and tokens the scenarios act with."""
+
+    def __init__(self, client, user_ids):
+        self.client = client
+        self.user_ids = user_ids
+        self.victims = list(user_ids)
+        self.admin = self._make_user('bench-admin', admin=True)
+        self.member = self._make_user('bench-member')
+        self.admin_headers = self._login('bench-admin')
+        self.member_headers = self._login('bench-member')
+
+    def _make_user(self, name, admin=False):
+        user = User(
+            username=name,
+            email='{}@bench.example.com'.format(name),
+            password=BENCH_PASSWORD)
+        user.admin = admin
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+    def _login(self, name):
+        response = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(
+                email='{}@bench.example.com'.format(name),
+                password=BENCH_PASSWORD)),
+            content_type='application/json')
+        token = json.loads(response.data.decode())['auth_token']
+        return dict(Authorization='Bearer ' + token)
+
+    def some_user(self, i):
+        return self.user_ids[i % len(self.user_ids)]
+
+
+def _new_user(prefix, i):
+    return dict(
+        username='{}{}'.format(prefix, i),
+        email='{}{}@bench.example.com'.format(prefix, i),
+        password=BENCH_PASSWORD)
+
+
+def _ping(ctx, i):
+    return ctx.client.get('/ping')
+
+
+def _get_single_user(ctx, i):
+    return ctx.client.get('/users/{}'.format(ctx.some_user(i)))
+
+
+def _get_users_page(ctx, i):
+    return ctx.client.get('/users?limit=100', headers=ctx.admin_headers)
+
+
+def _get_all_users(ctx, i):
+    return ctx.client.get('/users', headers=ctx.admin_headers)
+
+
+def _stream_users(ctx, i):
+    return ctx.client.get('/users?stream=1', headers=ctx.admin_headers)
+
+
+def _search_users(ctx, i):
+    return ctx.client.get(
+        '/users/search?q=ali', headers=ctx.admin_headers)
+
+
+def _add_user(ctx, i):
+    return ctx.client.post(
+        '/users', data=json.dumps(_new_user('bench-add', i)),
+        content_type='application/json', headers=ctx.admin_headers)
+
+
+def _bulk_add_users(ctx, i):
+    body = '\n'.join(json.dumps(_new_user('bench-bulk{}-'.format(i), n))
+                     for n in range(10))
+    return ctx.client.post(
+        '/users/bulk', data=body, content_type='application/x-ndjson',
+        headers=ctx.admin_headers)
+
+
+def _modify_user(ctx, i):
+    user_id = ctx.some_user(i)
+    user = db.session.query(User.email).filter_by(id=user_id).first()
+    return ctx.client.put(
+        '/users/{}'.format(user_id),
+        data=json.dumps(dict(
+            username='bench-renamed{}-{}'.format(user_id, i),
+            email=user.email)),
+        content_type='application/json', headers=ctx.admin_headers)
+
+
+def _delete_user(ctx, i):
+    return ctx.client.delete(
+        '/users/{}'.format(ctx.victims.pop()), headers=ctx.admin_headers)
+
+
+def _register(ctx, i):
+    return ctx.client.post(
+        '/auth/register', data=json.dumps(_new_user('bench-register', i)),
+        content_type='application/json')
+
+
+def _login(ctx, i):
+    return ctx.client.post(
+        '/auth/login',
+        data=json.dumps(dict(
+            email='bench-member@bench.example.com',
+            password=BENCH_PASSWORD)),
+        content_type='application/json')
+
+
+def _logout(ctx, i):
+    return ctx.client.get('/auth/logout', headers=ctx.member_headers)
+
+
+def _status(ctx, i):
+    return ctx.client.get('/auth/status', headers=ctx.member_headers)
+
+
+# name -> (flask endpoint it exercises, scenario)
+SCENARIOS = OrderedDict([
+    ('GET /ping', ('users.ping_pong', _ping)),
+    ('GET /users/<id>', ('users.get_single_user', _get_single_user)),
+    ('GET /users?limit=100', ('users.get_all_users', _get_users_page)),
+    ('GET /users', ('users.get_all_users', _get_all_users)),
+    ('GET /users?stream=1', ('users.get_all_users', _stream_users)),
+    ('GET /users/search', ('users.search_users', _search_users)),
+    ('POST /users', ('users.add_user', _add_user)),
+    ('POST /users/bulk', ('users.bulk_add_users', _bulk_add_users)),
+    ('PUT /users/<id>', ('users.modify_user', _modify_user)),
+    ('DELETE /users/<id>', ('users.delete_user', _delete_user)),
+    ('POST /auth/register', ('auth.register_user', _register)),
+    ('POST /auth/login', ('auth.login_user', _login)),
+    ('GET /auth/logout', ('auth.logout_user', _logout)),
+    ('GET /auth/status', ('auth.get_user_status', _status)),
+])
+
+
+def uncovered_endpoints(app):
+    """Blueprint endpoints that no scenario exercises."""
+    covered = {endpoint for endpoint, _ in SCENARIOS.values()}
+    return sorted(
+        rule.endpoint for rule in app.url_map.iter_rules()
+        if rule.endpoint.split('.')[0] in ('users', 'auth')
+        and rule.endpoint not in covered)
+
+
+def run_scenario(ctx, scenario, requests):
+    latencies = []
+    queries = 0
+    start = time.perf_counter()
+    for i in range(requests):
+        with QueryCounter(db.engine) as counter:
+            began = time.perf_counter()
+            response = scenario(ctx, i)
+            # read streamed bodies so their time is counted too
+            response.get_data()
+            latencies.append((time.perf_counter() - began) * 1000)
+        if response.status_code >= 500:
+            raise RuntimeError('{} answered {}'.format(
+                scenario.__name__, response.status_code))
+        queries += counter.count
+    elapsed = time.perf_counter() - start
+    return OrderedDict([
+        ('requests', requests),
+        ('p50_ms', percentile(latencies, 50)),
+        ('p95_ms', percentile(latencies, 95)),
+        ('p99_ms', percentile(latencies, 99)),
+        ('rps', requests / elapsed if elapsed else 0.0),
+        ('queries_per_request', queries / float(requests)),
+    ])
+
+
+def run_benchmarks(app, users, requests, only=None):
+    """Seed ``users`` rows into the app's database and time every scenario.
+
+    The database is dropped and recreated first, so point the app at a
+    scratch database.
+    """
+    token_cache.clear()
+    user_cache.clear()
+    db.drop_all()
+    db.create_all()
+    # leave enough seeded users for every DELETE iteration
+    seed_users(max(users, requests), batch_size=10000, seed=0)
+    user_ids = [row.id for row in db.session.query(User.id)]
+    ctx = BenchContext(app.test_client(), user_ids)
+    results = OrderedDict()
+    for name, (_, scenario) in SCENARIOS.items():
+        if only and name not in only:
+            continue
+        results[name] = run_scenario(ctx, scenario, requests)
+    db.session.remove()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return a message for each tracked endpoint that regressed.
+
+    An endpoint regresses when its p95 latency grows by more than
+    ``threshold`` (a fraction) or it runs more queries per request.
+    """
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            continue
+        limit = base['p95_ms'] * (1 + threshold)
+        if current['p95_ms'] > limit:
+            regressions.append('{}: p95 {:.2f} ms > {:.2f} ms'.format(
+                name, current['p95_ms'], limit))
+        if current['queries_per_request'] > base['queries_per_request']:
+            regressions.append('{}: {:.2f} queries/request > {:.2f}'.format(
+                name, current['queries_per_request'],
+                base['queries_per_request']))
+    return regressions
+
+
+def format_results(results):
+    lines = ['{:<22} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+        'endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries')]
+    for name, r in results.items():
+        lines.append('{:<22} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.1f} {:>9.2f}'.format(
+            name, r['p50_ms'], r['p95_ms'], r['p99_ms'], r['rps'],
+            r['queries_per_request']))
+    return '\n'.join(lines)
@@ -0,0 +1,112 @@
+# project/bench/micro.py
+
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from project import bcrypt, config, db, token_cache, user_cache
+from project.api.models import User
+from project.api.utils import authenticate
+
+
+MICRO_PASSWORD = 'benchmark'
+
+
+def configured_bcrypt_rounds():
+    """Every BCRYPT_LOG_ROUNDS used by a config class, lowest first."""
+    return sorted({
+        cls.BCRYPT_LOG_ROUNDS for cls in vars(config).values()
+        if isinstance(cls, type) and issubclass(cls, config.BaseConfig)})
+
+
+def measure(fn, iterations, repeat):
+    """Best-of-``repeat`` ops/sec over ``iterations`` calls, plus the peak
+    bytes traced while running a single call.
+
+    Taking the best run keeps the numbers comparable between runs on the
+    same machine, since noise only ever makes a run slower.
+    """
+    fn()  # warm up
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    try:
+        tracemalloc.clear_traces()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return OrderedDict([
+        ('iterations', iterations),
+        ('ops_per_sec', iterations / best if best else 0.0),
+        ('us_per_op', best / iterations * 1e6),
+        ('peak_bytes_per_op', peak),
+    ])
+
+
+def run_microbenchmarks(app, iterations, repeat, bcrypt_iterations):
+    """Time the pieces of an authenticated request outside of HTTP."""
+    token_cache.clear()
+    user_cache.clear()
+    db.drop_all()
+    db.create_all()
+    user = User(username='micro', email='micro@bench.example.com',
+                password=MICRO_PASSWORD)
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    token = user.encode_auth_token(user_id)
+    headers = dict(Authorization='Bearer ' + token.decode())
+    protected = authenticate(lambda resp: resp)
+
+    def authenticate_cached():
+        with app.test_request_context(headers=headers):
+            protected()
+
+    def authenticate_uncached():
+        token_cache.clear()
+        user_cache.clear()
+        with app.test_request_context(headers=headers):
+            protected()
+
+    def request_context_only():
+        with app.test_request_context(headers=headers):
+            pass
+
+    results = OrderedDict()
+    results['encode_auth_token'] = measure(
+        lambda: user.encode_auth_token(user_id), iterations, repeat)
+    results['decode_auth_token'] = measure(
+        lambda: User.decode_auth_token(token), iterations, repeat)
+    for rounds in configured_bcrypt_rounds():
+        hashed = bcrypt.generate_password_hash(MICRO_PASSWORD, rounds)
+        results['check_password_hash[{}]'.format(rounds)] = measure(
+            lambda: bcrypt.check_password_hash(hashed, MICRO_PASSWORD),
+            bcrypt_iterations, repeat)
+    results['request_context_only'] = measure(
+        request_context_only, iterations, repeat)
+    results['authenticate[token cache hit]'] = measure(
+        authenticate_cached, iterations, repeat)
+    results['authenticate[db lookup]'] = measure(
+        authenticate_uncached, iterations, repeat)
+    db.session.remove()
+    return results
+
+
+def format_results(results, baseline=None):
+    lines = ['{:<32} {:>12} {:>10} {:>12} {:>9}'.format(
+        'benchmark', 'ops/s', 'us/op', 'peak B/op', 'change')]
+    for name, r in results.items():
+        change = ''
+        if baseline and name in baseline and baseline[name]['ops_per_sec']:
+            change = '{:+.1%}'.format(
+                r['ops_per_sec'] / baseline[name]['ops_per_sec'] - 1)
+        lines.append('{:<32} {:>12.1f} {:>10.1f} {:>12} {:>9}'.format(
+            name, r['ops_per_sec'], r['us_per_op'], r['peak_bytes_per_op'],
+            change))
+    return '\n'.join(lines)
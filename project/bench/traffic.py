@@ -0,0 +1,328 @@
+# project/bench/traffic.py
+
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import OrderedDict, defaultdict
+from urllib.parse import urlencode, urlsplit
+
+from project.bench.calibrate import percentile
+
+
+# upper bounds, in milliseconds, of the latency histogram buckets
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+NDJSON_USER_SHAPE = {'username': 'str', 'email': 'str', 'password': 'str'}
+NDJSON_LINE_BYTES = 70
+
+
+def load_recording(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class HTTPClient:
+    """Minimal keep-alive HTTP/1.1 client on asyncio streams."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = parts.scheme == 'https'
+        self.prefix = parts.path.rstrip('/')
+        self._reader = None
+        self._writer = None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def request(self, method, path, headers=None, body=b''):
+        lines = ['{} {}{} HTTP/1.1'.format(method, self.prefix, path),
+                 'Host: {}'.format(self.host),
+                 'Content-Length: {}'.format(len(body))]
+        lines += ['{}: {}'.format(k, v) for k, v in (headers or {}).items()]
+        message = ('\r\n'.join(lines) + '\r\n\r\n').encode() + body
+        # a reused connection may have been closed by the server while idle;
+        # that is worth one retry on a fresh connection
+        retry = self._writer is not None
+        while True:
+            if self._writer is None:
+                await self._connect()
+            self._writer.write(message)
+            try:
+                return await self._read_response()
+            except ConnectionError:
+                self.close()
+                if not retry:
+                    raise
+                retry = False
+            except Exception:
+                self.close()
+                raise
+
+    async def _read_response(self):
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed')
+        version, status = status_line.split()[:2]
+        status = int(status)
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        if 'content-length' in headers:
+            body = await self._reader.readexactly(
+                int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int((await self._reader.readline()).strip(), 16)
+                chunk = await self._reader.readexactly(size + 2)
+                if not size:
+                    break
+                body += chunk[:-2]
+        else:
+            body = await self._reader.read()
+            self.close()
+        connection = headers.get('connection', '').lower()
+        if connection == 'close' or (
+                version == b'HTTP/1.0' and connection != 'keep-alive'):
+            self.close()
+        return status, body
+
+
+class ReplayUsers:
+    """Accounts the replay acts as, one per user seen in the recording."""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.tokens = {}
+        self.ids = {}
+        self.credentials = []
+        self.admin_token = None
+
+    async def register(self, client, recorded_id):
+        name = 'replay-{}-{}'.format(self.run_id, recorded_id)
+        email = name + '@replay.example.com'
+        password = 'replay-password'
+        token = await self._token(client, '/auth/register', dict(
+            username=name, email=email, password=password))
+        status, body = await client.request(
+            'GET', '/auth/status', {'Authorization': 'Bearer ' + token})
+        self.tokens[recorded_id] = token
+        self.ids[recorded_id] = json.loads(body.decode())['data']['id']
+        self.credentials.append(dict(email=email, password=password))
+
+    async def login_admin(self, client, email, password):
+        self.admin_token = await self._token(
+            client, '/auth/login', dict(email=email, password=password))
+
+    @staticmethod
+    async def _token(client, path, payload):
+        status, body = await client.request(
+            'POST', path, {'Content-Type': 'application/json'},
+            json.dumps(payload).encode())
+        if status >= 300:
+            raise RuntimeError('{} failed with {}'.format(path, status))
+        return json.loads(body.decode())['auth_token']
+
+    def token_for(self, entry):
+        if entry['auth_admin'] and self.admin_token:
+            return self.admin_token
+        return self.tokens.get(entry['auth_user'])
+
+
+def _is_id_arg(key):
+    return key == 'id' or key.endswith('_id')
+
+
+def recorded_user_ids(entries):
+    """Ids of the users a recording acts as or acts on, and 0."""
+    ids = {0}
+    for entry in entries:
+        if entry['auth_user'] is not None:
+            ids.add(entry['auth_user'])
+        for key, value in (entry['view_args'] or {}).items():
+            if _is_id_arg(key) and str(value).isdigit():
+                ids.add(int(value))
+    return ids
+
+
+def build_request(entry, n, users):
+    """Turn a recorded entry into (method, path, headers, body).
+
+    User ids in the path point at the replay's stand-in for that user, so
+    a replayed PUT or DELETE never touches an account the replay did not
+    create. Ids without a stand-in become 0, which matches no user.
+    """
+    path = entry['rule']
+    for key, value in (entry['view_args'] or {}).items():
+        if _is_id_arg(key) and str(value).isdigit():
+            value = users.ids.get(int(value), 0)
+        path = path.replace('<{}>'.format(key), str(value))
+    query = {key: _fake_query_value(key) for key in entry['query']}
+    if query:
+        path += '?' + urlencode(query)
+    headers = {}
+    token = users.token_for(entry)
+    if token:
+        headers['Authorization'] = 'Bearer ' + token
+    body = b''
+    shape = entry['body']
+    if shape and 'ndjson_bytes' in shape:
+        # bulk imports: a user line is roughly NDJSON_LINE_BYTES long
+        headers['Content-Type'] = 'application/x-ndjson'
+        body = '\n'.join(
+            json.dumps(_fake_body(NDJSON_USER_SHAPE, '{}-{}'.format(n, i)))
+            for i in range(max(1, shape['ndjson_bytes'] // NDJSON_LINE_BYTES))
+        ).encode()
+    elif shape is not None:
+        headers['Content-Type'] = 'application/json'
+        if entry['rule'] == '/auth/login' and users.credentials:
+            payload = random.choice(users.credentials)
+        else:
+            payload = _fake_body(shape, n)
+        body = json.dumps(payload).encode()
+    return entry['method'], path, headers, body
+
+
+def _fake_query_value(key):
+    return {'limit': '100', 'stream': '1'}.get(key, '')
+
+
+def _fake_body(shape, n):
+    body = {}
+    for key, kind in (shape or {}).items():
+        if kind != 'str':
+            body[key] = None
+        elif key == 'email':
+            body[key] = 'replay{}@replay.example.com'.format(n)
+        elif key == 'password':
+            body[key] = 'replay-password'
+        else:
+            body[key] = 'replay{}'.format(n)
+    return body
+
+
+class ReplayStats:
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+
+    def add(self, name, latency_ms, status):
+        self.latencies[name].append(latency_ms)
+        self.statuses[name][status] += 1
+
+    def error(self, name):
+        self.errors[name] += 1
+
+    def summary(self):
+        summary = OrderedDict()
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            latencies = self.latencies[name]
+            histogram = OrderedDict()
+            for bound in HISTOGRAM_BUCKETS + (float('inf'),):
+                label = '<={}'.format(bound) if bound != float('inf') else '+Inf'
+                histogram[label] = sum(
+                    1 for value in latencies if value <= bound)
+            summary[name] = OrderedDict([
+                ('requests', len(latencies)),
+                ('p50_ms', percentile(latencies, 50)),
+                ('p95_ms', percentile(latencies, 95)),
+                ('p99_ms', percentile(latencies, 99)),
+                ('max_ms', max(latencies) if latencies else 0.0),
+                ('statuses', dict(self.statuses[name])),
+                ('errors', self.errors[name]),
+                ('histogram', histogram),
+            ])
+        return summary
+
+
+async def replay(entries, base_url, concurrency, rate, total,
+                 admin_email=None, admin_password=None):
+    """Replay a recorded request mix against ``base_url``.
+
+    ``concurrency`` connections send requests in parallel. With a ``rate``
+    (requests per second) they are paced open-loop, otherwise sent as fast
+    as the server answers. The recording is cycled until ``total``
+    requests have gone out.
+    """
+    users = ReplayUsers(int(time.time()))
+    setup = HTTPClient(base_url)
+    for recorded_id in sorted(recorded_user_ids(entries)):
+        await users.register(setup, recorded_id)
+    if admin_email:
+        await users.login_admin(setup, admin_email, admin_password)
+    setup.close()
+
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    stats = ReplayStats()
+
+    async def produce():
+        mix = itertools.islice(itertools.cycle(entries), total)
+        start = time.perf_counter()
+        for n, entry in enumerate(mix):
+            if rate:
+                delay = start + n / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await queue.put((n, entry))
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def consume():
+        client = HTTPClient(base_url)
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            n, entry = item
+            name = '{} {}'.format(entry['method'], entry['rule'])
+            method, path, headers, body = build_request(entry, n, users)
+            began = time.perf_counter()
+            try:
+                status, _ = await client.request(method, path, headers, body)
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                stats.error(name)
+                continue
+            stats.add(name, (time.perf_counter() - began) * 1000, status)
+        client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(produce(), *[consume() for _ in range(concurrency)])
+    return stats.summary(), time.perf_counter() - start
+
+
+def format_summary(summary, elapsed):
+    lines = ['{:<28} {:>7} {:>8} {:>8} {:>8} {:>6} {:>6} {:>6}'.format(
+        'endpoint', 'count', 'p50 ms', 'p95 ms', 'p99 ms', '4xx', '5xx', 'err')]
+    total = 0
+    for name, s in summary.items():
+        total += s['requests']
+        client_errors = sum(c for code, c in s['statuses'].items()
+                            if 400 <= code < 500)
+        server_errors = sum(c for code, c in s['statuses'].items()
+                            if code >= 500)
+        lines.append(
+            '{:<28} {:>7} {:>8.1f} {:>8.1f} {:>8.1f} {:>6} {:>6} {:>6}'.format(
+                name, s['requests'], s['p50_ms'], s['p95_ms'], s['p99_ms'],
+                client_errors, server_errors, s['errors']))
+        lines.append('    ' + '  '.join(
+            '{}:{}'.format(bucket, count)
+            for bucket, count in s['histogram'].items()))
+    lines.append('{} requests in {:.1f} s ({:.1f} req/s)'.format(
+        total, elapsed, total / elapsed if elapsed else 0.0))
+    return '\n'.join(lines)
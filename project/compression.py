@@ -0,0 +1,179 @@
+# project/compression.py
+
+import re
+import zlib
+
+from flask import current_app, g, request
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class _ZlibEncoder:
+
+    def __init__(self, level, wbits):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _ZstdEncoder:
+
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def gzip_encoder(config):
+    return _ZlibEncoder(config.get('COMPRESS_LEVEL'), 16 + zlib.MAX_WBITS)
+
+
+def deflate_encoder(config):
+    # HTTP's "deflate" is the zlib format, not raw deflate
+    return _ZlibEncoder(config.get('COMPRESS_LEVEL'), zlib.MAX_WBITS)
+
+
+def zstd_encoder(config):
+    return _ZstdEncoder(config.get('COMPRESS_ZSTD_LEVEL'))
+
+
+ENCODERS = {
+    'gzip': gzip_encoder,
+    'deflate': deflate_encoder,
+}
+if zstandard is not None:
+    ENCODERS['zstd'] = zstd_encoder
+
+# an ETag as _after_request suffixes it, quotes included
+_SUFFIXED_ETAG = re.compile(r'"([^"]*)-(gzip|deflate|zstd)"')
+
+
+def available_encodings(config):
+    """COMPRESS_ENCODINGS that can be used here, in order of preference."""
+    return [name for name in config.get('COMPRESS_ENCODINGS') or ()
+            if name in ENCODERS]
+
+
+def negotiate(accept_encodings, encodings):
+    """The encoding the client rates highest; ties go to ``encodings`` order."""
+    best, best_quality = None, 0
+    for name in encodings:
+        quality = accept_encodings[name]
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def compress_stream(chunks, encoder, flush_size, close=None):
+    """Compress an iterable of bytes as it is consumed.
+
+    Output is flushed once ``flush_size`` bytes went in since the last
+    flush, so a slow stream still reaches the client in pieces. ``close``
+    is called once the stream is done with, however it ends.
+    """
+    pending = 0
+    try:
+        for chunk in chunks:
+            data = encoder.compress(chunk)
+            pending += len(chunk)
+            if pending >= flush_size:
+                data += encoder.flush()
+                pending = 0
+            if data:
+                yield data
+        yield encoder.finish()
+    finally:
+        if close is not None:
+            close()
+
+
+class Compression:
+    """Compress responses with the best encoding the client accepts.
+
+    Bodies of a COMPRESS_MIMETYPES type are gzip, deflate or, when the
+    zstandard package is installed, zstd encoded. Bodies smaller than
+    COMPRESS_MIN_SIZE are sent as they are; streamed bodies, whose size
+    is not known up front, are compressed chunk by chunk.
+
+    ETags get the encoding as a suffix, as the encoded body is another
+    representation. The suffix is stripped from conditional request
+    headers, so views compare against the ETags they computed.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    @staticmethod
+    def _before_request():
+        g.compressed_etags = {}
+        for header in ('HTTP_IF_NONE_MATCH', 'HTTP_IF_MATCH'):
+            value = request.environ.get(header)
+            if not value:
+                continue
+            for tag, encoding in _SUFFIXED_ETAG.findall(value):
+                g.compressed_etags[tag] = encoding
+            request.environ[header] = _SUFFIXED_ETAG.sub(r'"\1"', value)
+
+    @staticmethod
+    def _after_request(response):
+        config = current_app.config
+        if response.status_code == 304:
+            # confirm the encoded copy the client asked about
+            tag, weak = response.get_etag()
+            encoding = g.get('compressed_etags', {}).get(tag)
+            if encoding is not None:
+                response.set_etag('{}-{}'.format(tag, encoding), weak)
+            return response
+        if (response.mimetype not in config.get('COMPRESS_MIMETYPES') or
+                response.status_code < 200 or response.status_code == 204 or
+                response.direct_passthrough or
+                'Content-Encoding' in response.headers or
+                'no-transform' in response.headers.get('Cache-Control', '')):
+            return response
+        encodings = available_encodings(config)
+        if not encodings:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.accept_encodings, encodings)
+        if encoding is None:
+            return response
+        encoder = ENCODERS[encoding](config)
+        if response.is_streamed:
+            body = response.response
+            response.response = compress_stream(
+                response.iter_encoded(), encoder,
+                config.get('COMPRESS_STREAM_FLUSH_SIZE'),
+                getattr(body, 'close', None))
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < config.get('COMPRESS_MIN_SIZE'):
+                return response
+            response.set_data(encoder.compress(data) + encoder.finish())
+        response.headers['Content-Encoding'] = encoding
+        tag, weak = response.get_etag()
+        if tag is not None:
+            response.set_etag('{}-{}'.format(tag, encoding), weak)
+        return response
@@ -1,14 +1,92 @@
 import os
+import tempfile
+
+
+def env_flag(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
 
 class BaseConfig:
     """Base Configuration"""
     DEBUG = False
     TESTING = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # per gunicorn worker: size the pool so that
+    # workers * (POOL_SIZE + MAX_OVERFLOW) stays under max_connections
+    SQLALCHEMY_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+    SQLALCHEMY_POOL_TIMEOUT = int(os.environ.get('DATABASE_POOL_TIMEOUT', 30))
+    SQLALCHEMY_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', 3600))
+    SQLALCHEMY_POOL_PRE_PING = env_flag('DATABASE_POOL_PRE_PING')
+    # connect through PgBouncer in transaction pooling mode
+    SQLALCHEMY_PGBOUNCER = env_flag('DATABASE_PGBOUNCER')
+    # comma separated; read-only endpoints are served from these
+    SQLALCHEMY_REPLICA_URIS = [
+        uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+        if uri]
+    # round_robin or least_connections
+    REPLICA_BALANCING = os.environ.get('REPLICA_BALANCING', 'round_robin')
+    REPLICA_READ_YOUR_WRITES_SECONDS = float(
+        os.environ.get('REPLICA_READ_YOUR_WRITES_SECONDS', 5))
     SECRET_KEY = os.environ.get('SECRET_KEY')
-    BCRYPT_LOG_ROUNDS = 13
+    # new hashes use this scheme; existing ones are upgraded on login
+    PASSWORD_SCHEME = os.environ.get('PASSWORD_SCHEME', 'bcrypt')
+    # measure with `python manage.py calibrate_bcrypt` before changing
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 13))
+    SCRYPT_LOG_N = int(os.environ.get('SCRYPT_LOG_N', 14))
+    SCRYPT_R = int(os.environ.get('SCRYPT_R', 8))
+    SCRYPT_P = int(os.environ.get('SCRYPT_P', 1))
+    PASSWORD_POOL_WORKERS = int(os.environ.get('PASSWORD_POOL_WORKERS', 2))
+    PASSWORD_POOL_QUEUE_SIZE = int(os.environ.get('PASSWORD_POOL_QUEUE_SIZE', 16))
+    PASSWORD_POOL_RETRY_AFTER = 1
+    # how many workers batch hashing may use; 0 for half of them
+    PASSWORD_POOL_BULK_WORKERS = int(
+        os.environ.get('PASSWORD_POOL_BULK_WORKERS', 0))
     TOKEN_EXPIRATION_DAYS = 30
     TOKEN_EXPIRATION_SECONDS = 0
+    TOKEN_CACHE_SIZE = 10000
+    TOKEN_CACHE_TTL_SECONDS = 60
+    # memory, shared or empty (the default) to disable. Both need
+    # USER_CACHE_PATH, a SQLite file on the host through which the workers
+    # tell each other about changed users. Set it whenever several workers
+    # run, even with the cache off: it also keeps their token caches honest
+    # and lets them all route a recent writer's reads to the primary.
+    USER_CACHE_BACKEND = os.environ.get('USER_CACHE_BACKEND', '')
+    USER_CACHE_PATH = os.environ.get('USER_CACHE_PATH')
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL_SECONDS = 60
+    USER_CACHE_SYNC_SECONDS = 0.1
+    # how long a lookup waits on another request's query for the same user
+    # before running its own
+    USER_LOOKUP_WAIT_SECONDS = 2
+    USERS_PAGE_DEFAULT_LIMIT = 100
+    USERS_PAGE_MAX_LIMIT = 1000
+    USERS_STREAM_BATCH_SIZE = 1000
+    USERS_SEARCH_DEFAULT_LIMIT = 20
+    USERS_SEARCH_MAX_LIMIT = 100
+    # shorter terms only match prefixes
+    USERS_SEARCH_MIN_SUBSTRING = 3
+    USERS_SEARCH_TIMEOUT_MS = int(os.environ.get('USERS_SEARCH_TIMEOUT_MS', 500))
+    BULK_IMPORT_CHUNK_SIZE = 1000
+    # larger imports go through `manage.py import_users`
+    BULK_IMPORT_MAX_BYTES = 1024 * 1024
+    BULK_IMPORT_MAX_ROWS = 1000
+    # set to a path to record the request mix for `manage.py replay`
+    TRAFFIC_RECORD_FILE = os.environ.get('TRAFFIC_RECORD_FILE')
+    SQL_DEBUG_HEADERS = False
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+    SQL_REPEAT_THRESHOLD = int(os.environ.get('SQL_REPEAT_THRESHOLD', 5))
+    # in order of preference; zstd needs the zstandard package
+    COMPRESS_ENCODINGS = ('zstd', 'gzip', 'deflate')
+    COMPRESS_MIMETYPES = ('application/json', 'application/x-ndjson',
+                          'text/html', 'text/plain')
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+    COMPRESS_ZSTD_LEVEL = int(os.environ.get('COMPRESS_ZSTD_LEVEL', 3))
+    COMPRESS_STREAM_FLUSH_SIZE = 64 * 1024
 
 
 class DevelopmentConfig(BaseConfig):
@@ -16,6 +94,7 @@ class DevelopmentConfig(BaseConfig):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     BCRYPT_LOG_ROUNDS = 4
+    SQL_DEBUG_HEADERS = True
 
 
 class TestingConfig(BaseConfig):
@@ -23,7 +102,11 @@ class TestingConfig(BaseConfig):
     DEBUG = True
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_TEST_URL')
+    SQLALCHEMY_REPLICA_URIS = []
+    USER_CACHE_BACKEND = 'memory'
+    USER_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'users-test-cache.db')
     BCRYPT_LOG_ROUNDS = 4
+    SQL_DEBUG_HEADERS = True
     TOKEN_EXPIRATION_DAYS = 0
     TOKEN_EXPIRATION_SECONDS = 3
 
@@ -32,6 +115,10 @@ class ProductionConfig(BaseConfig):
     """Production configuration"""
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    # fail fast rather than queue behind a saturated pool
+    SQLALCHEMY_POOL_TIMEOUT = int(os.environ.get('DATABASE_POOL_TIMEOUT', 10))
+    SQLALCHEMY_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', 1800))
+    SQLALCHEMY_POOL_PRE_PING = env_flag('DATABASE_POOL_PRE_PING', True)
 
 class StagingConfig(BaseConfig):
     """Stating configuration"""
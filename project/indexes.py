@@ -0,0 +1,116 @@
+# project/indexes.py
+
+import datetime
+import re
+from collections import OrderedDict
+
+from sqlalchemy import or_
+
+from project.api.models import User
+from project.api.pagination import USERS_ORDER, seek
+from project.api.search import search_query
+from project.queries import explain
+
+
+PAGE = 101
+
+# the lookups every request path depends on, as the endpoints build them
+HOT_QUERIES = OrderedDict([
+    ('authenticate: user by id',
+     lambda: User.query.filter_by(id=1).limit(1)),
+    ('login: user by email',
+     lambda: User.query.filter(
+         User.email_matches('Someone@Example.com')).limit(1)),
+    ('register: existing username or email',
+     lambda: User.query.filter(or_(
+         User.email_matches('someone@example.com'),
+         User.username == 'someone')).limit(1)),
+    ('GET /users: first page',
+     lambda: User.query.order_by(*USERS_ORDER).limit(PAGE)),
+    ('GET /users: next page',
+     lambda: seek(User.query.order_by(*USERS_ORDER),
+                  datetime.datetime(2017, 1, 1), 1).limit(PAGE)),
+])
+
+# Reading the index from one end is right for these, as LIMIT stops them.
+# Every other hot query must jump into its index.
+ORDERED_READS = {'GET /users: first page'}
+
+# Served by trigram indexes, so only checked on Postgres. Ranking needs a
+# sort whatever the plan, so only the row lookup has to use an index.
+POSTGRES_QUERIES = OrderedDict([
+    ('GET /users/search',
+     lambda: search_query('someone', 20)),
+])
+
+# users read row by row, whether from the table or a whole index
+_SQLITE_SCAN = re.compile(r'\bSCAN (TABLE )?users\b')
+_SQLITE_TABLE_SCAN = re.compile(r'\bSCAN (TABLE )?users\b(?! USING)')
+_SQLITE_SEEK = re.compile(r'\bSEARCH (TABLE )?users\b')
+_POSTGRES_SORT = re.compile(r'\bSort\b')
+
+
+def plan(connection, query):
+    """The database's plan for a Query, run on ``connection``."""
+    compiled = query.statement.compile(dialect=connection.dialect)
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    cursor = connection.connection.cursor()
+    try:
+        return explain(connection, cursor, str(compiled), params)
+    finally:
+        cursor.close()
+
+
+def index_backed(dialect_name, query_plan, seeks=True, sorted_by_index=True):
+    """Whether a plan reads users through an index.
+
+    A plan that ``seeks`` must jump into the index (SQLite's SEARCH, an
+    Index Cond on Postgres) instead of walking all of it, which a Filter
+    on an index scan would hide. A ``sorted_by_index`` plan must not sort
+    rows after reading them.
+    """
+    if dialect_name == 'sqlite':
+        if sorted_by_index and 'TEMP B-TREE' in query_plan:
+            return False
+        if seeks:
+            return (bool(_SQLITE_SEEK.search(query_plan)) and
+                    not _SQLITE_SCAN.search(query_plan))
+        return not _SQLITE_TABLE_SCAN.search(query_plan)
+    if 'Seq Scan' in query_plan:
+        return False
+    if sorted_by_index and _POSTGRES_SORT.search(query_plan):
+        return False
+    return not seeks or 'Index Cond' in query_plan
+
+
+def check_indexes(session):
+    """EXPLAIN every hot query; a list of (name, plan, index backed)."""
+    connection = session.connection()
+    dialect_name = connection.dialect.name
+    checks = [(name, build, name not in ORDERED_READS, True)
+              for name, build in HOT_QUERIES.items()]
+    if dialect_name == 'postgresql':
+        # a small table is cheaper to scan, which would hide whether
+        # the index can serve the query at all
+        connection.execute('SET LOCAL enable_seqscan = off')
+        checks.extend((name, build, True, False)
+                      for name, build in POSTGRES_QUERIES.items())
+    try:
+        results = []
+        for name, build, seeks, sorted_by_index in checks:
+            query_plan = plan(connection, build())
+            results.append((name, query_plan, index_backed(
+                dialect_name, query_plan, seeks, sorted_by_index)))
+        return results
+    finally:
+        session.rollback()
+
+
+def format_results(results):
+    lines = []
+    for name, query_plan, ok in results:
+        lines.append('{} {}'.format('ok  ' if ok else 'FAIL', name))
+        lines.extend('       ' + line for line in query_plan.splitlines())
+    return '\n'.join(lines)
@@ -0,0 +1,114 @@
+# project/metrics.py
+
+import os
+import time
+from functools import wraps
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+    Histogram, generate_latest, multiprocess)
+
+
+# Under gunicorn, point the prometheus_multiproc_dir environment variable at
+# an empty directory before the workers start. Every worker then writes its
+# samples there and /metrics sums them, whichever worker answers the scrape.
+
+REQUEST_COUNT = Counter(
+    'http_requests_total', 'HTTP requests handled.',
+    ['method', 'endpoint', 'status'])
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time spent handling a request.',
+    ['method', 'endpoint'])
+REQUEST_DB_TIME = Histogram(
+    'http_request_db_duration_seconds',
+    'Time a request spent waiting on SQL statements.',
+    ['method', 'endpoint'])
+QUERY_LATENCY = Histogram(
+    'db_query_duration_seconds', 'Time spent on one SQL statement.')
+DB_POOL_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds',
+    'Time spent waiting for a database connection from the pool.',
+    buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1.0, 5.0, 30.0))
+DB_POOL_IN_USE = Gauge(
+    'db_pool_connections_in_use', 'Database connections checked out.',
+    multiprocess_mode='livesum')
+USER_CACHE_LOOKUPS = Counter(
+    'user_cache_lookups_total', 'User cache lookups.', ['result'])
+USER_CACHE_EVICTIONS = Counter(
+    'user_cache_evictions_total', 'User cache entries evicted for room.')
+USER_LOOKUPS_COALESCED = Counter(
+    'user_lookups_coalesced_total',
+    'User lookups that waited on the same query of another request.',
+    ['result'])
+PASSWORD_LATENCY = Histogram(
+    'password_hash_duration_seconds',
+    'Time spent hashing or verifying one password.',
+    ['operation'],
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0))
+JWT_LATENCY = Histogram(
+    'jwt_decode_duration_seconds', 'Time spent verifying one auth token.',
+    buckets=(.00001, .00005, .0001, .00025, .0005, .001, .005, .01))
+
+
+def timed(histogram):
+    """Decorate a function so every call is observed by ``histogram``."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def _endpoint():
+    # the route rule, not the concrete path, keeps label cardinality bounded
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+class Metrics:
+    """Per-endpoint request metrics, exported at /metrics."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self._metrics_view)
+
+    @staticmethod
+    def _before_request():
+        g.metrics_start = time.perf_counter()
+
+    @staticmethod
+    def _after_request(response):
+        start = g.get('metrics_start')
+        if start is None:
+            return response
+        endpoint = _endpoint()
+        REQUEST_COUNT.labels(
+            request.method, endpoint, response.status_code).inc()
+        REQUEST_LATENCY.labels(request.method, endpoint).observe(
+            time.perf_counter() - start)
+        query_stats = g.get('query_stats')
+        if query_stats is not None:
+            REQUEST_DB_TIME.labels(request.method, endpoint).observe(
+                query_stats.duration)
+        return response
+
+    @staticmethod
+    def _metrics_view():
+        registry = REGISTRY
+        if os.environ.get('prometheus_multiproc_dir'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return Response(
+            generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
@@ -0,0 +1,99 @@
+# project/pool.py
+
+import threading
+import time
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+from project.metrics import DB_POOL_IN_USE, DB_POOL_WAIT
+
+
+# create_engine() rejects these for pools that do not keep a queue
+QUEUE_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+
+class MonitoredPool:
+    """Pool mixin timing each checkout and tracking connections in use.
+
+    ``_do_get`` blocks while every connection is checked out, so its
+    duration is the wait a request saw before it could talk to the
+    database. Threads check connections in and out concurrently, so the
+    count is kept under a lock.
+    """
+
+    in_use = 0
+
+    def __init__(self, *args, **kwargs):
+        self._in_use_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            record = super()._do_get()
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - start)
+        with self._in_use_lock:
+            self.in_use += 1
+        DB_POOL_IN_USE.inc()
+        return record
+
+    def _do_return_conn(self, conn):
+        with self._in_use_lock:
+            self.in_use -= 1
+        DB_POOL_IN_USE.dec()
+        super()._do_return_conn(conn)
+
+
+_monitored = {}
+
+
+def monitored(poolclass):
+    """The MonitoredPool subclass of ``poolclass``."""
+    if poolclass not in _monitored:
+        _monitored[poolclass] = type(
+            'Monitored' + poolclass.__name__, (MonitoredPool, poolclass), {})
+    return _monitored[poolclass]
+
+
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """Checkout listener replacing connections the server has dropped.
+
+    Raising DisconnectionError makes the pool discard the connection and
+    retry with a fresh one, so a restarted database or an idle timeout
+    costs a reconnect instead of a failed request.
+    """
+    try:
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+    except Exception:
+        raise exc.DisconnectionError()
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with the pool configured and monitored per app.
+
+    ``SQLALCHEMY_POOL_PRE_PING`` checks connections on checkout and
+    ``SQLALCHEMY_PGBOUNCER`` hands pooling to PgBouncer: every checkout
+    opens a new connection to it and closes it on return. In that mode
+    nothing may rely on session state surviving the transaction, so use
+    ``SET LOCAL`` rather than ``SET``.
+    """
+
+    def apply_driver_hacks(self, app, info, options):
+        super().apply_driver_hacks(app, info, options)
+        if app.config.get('SQLALCHEMY_PGBOUNCER'):
+            options['poolclass'] = NullPool
+        poolclass = options.get('poolclass') or \
+            info.get_dialect().get_pool_class(info)
+        if not issubclass(poolclass, QueuePool):
+            for key in QUEUE_OPTIONS:
+                options.pop(key, None)
+        options['poolclass'] = monitored(poolclass)
+        if app.config.get('SQLALCHEMY_POOL_PRE_PING') and \
+                poolclass is not NullPool:
+            options.setdefault('pool_events', []).append(
+                (ping_connection, 'checkout'))
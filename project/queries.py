@@ -0,0 +1,160 @@
+# project/queries.py
+
+import re
+import time
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from project.metrics import QUERY_LATENCY
+
+
+# IN lists of any length, whatever the DBAPI's placeholder style
+_IN_LIST = re.compile(r'IN \((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,?)+\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """A statement with IN lists collapsed, so repeats compare equal."""
+    return _IN_LIST.sub('IN (...)', _WHITESPACE.sub(' ', statement).strip())
+
+
+class QueryCounter:
+    """Count the SQL statements an engine runs inside a ``with`` block.
+
+    ``statements`` holds (statement, seconds) pairs in execution order.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+        self._started = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def duration(self):
+        return sum(seconds for _, seconds in self.statements)
+
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany):
+        self._started.append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany):
+        started = self._started.pop() if self._started else time.perf_counter()
+        self.statements.append((statement, time.perf_counter() - started))
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before)
+        event.listen(self.engine, 'after_cursor_execute', self._after)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._before)
+        event.remove(self.engine, 'after_cursor_execute', self._after)
+
+
+class RequestQueries:
+    """SQL statements run while handling the current request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def add(self, statement, seconds):
+        self.count += 1
+        self.duration += seconds
+        self.shapes[statement_shape(statement)] += 1
+
+
+def explain(conn, cursor, statement, parameters):
+    """The database's plan for ``statement``, or None if it has none."""
+    if not statement.lstrip().upper().startswith('SELECT'):
+        return None
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' \
+        else 'EXPLAIN '
+    # a raw DBAPI cursor, so the EXPLAIN itself does not fire these events
+    explain_cursor = cursor.connection.cursor()
+    try:
+        explain_cursor.execute(prefix + statement, parameters)
+        return '\n'.join(
+            ' '.join(str(column) for column in row)
+            for row in explain_cursor.fetchall())
+    except Exception as e:
+        return 'EXPLAIN failed: {}'.format(e)
+    finally:
+        explain_cursor.close()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    QUERY_LATENCY.observe(elapsed)
+    if not has_request_context():
+        return
+    stats = g.get('query_stats')
+    if stats is not None:
+        stats.add(statement, elapsed)
+    slow_ms = current_app.config.get('SLOW_QUERY_MS')
+    if slow_ms is not None and elapsed * 1000 >= slow_ms and not executemany:
+        current_app.logger.warning(
+            'Slow query (%.1f ms) during %s %s:\n%s\nPlan:\n%s',
+            elapsed * 1000, request.method, request.path, statement,
+            explain(conn, cursor, statement, parameters))
+
+
+class QueryInspector:
+    """Per-request SQL statistics.
+
+    Counts statements and the time spent in them for every request. With
+    SQL_DEBUG_HEADERS set, adds both to the response headers. Logs any
+    statement slower than SLOW_QUERY_MS with its plan, and warns when one
+    statement shape runs more than SQL_REPEAT_THRESHOLD times in a request,
+    which is what an N+1 pattern looks like.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    @staticmethod
+    def _before_request():
+        g.query_stats = RequestQueries()
+
+    @staticmethod
+    def _after_request(response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+        config = current_app.config
+        if config.get('SQL_DEBUG_HEADERS'):
+            response.headers['X-Query-Count'] = str(stats.count)
+            response.headers['X-Query-Time-Ms'] = '{:.2f}'.format(
+                stats.duration * 1000)
+        threshold = config.get('SQL_REPEAT_THRESHOLD')
+        for shape, count in stats.shapes.items():
+            if threshold and count > threshold:
+                current_app.logger.warning(
+                    'Statement ran %d times during %s %s (possible N+1): %s',
+                    count, request.method, request.path, shape)
+        return response
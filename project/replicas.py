@@ -0,0 +1,212 @@
+# project/replicas.py
+
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import orm
+
+from project.api.cache import _SQLiteFile
+from project.pool import PooledSQLAlchemy
+
+
+BIND_PREFIX = 'replica_'
+
+
+def read_only(f):
+    """Mark a view as safe to serve from a read replica.
+
+    The mark lasts until the request is torn down, so a streamed response
+    keeps reading from the replica after the view has returned.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.replica_reads = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+class RoutingSession(SignallingSession):
+    """Session sending reads to a replica when the request allows it.
+
+    Flushes always go to the primary, as does everything outside a
+    read-only view or ``ReplicaRouter.reads`` block.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        router = self.app.extensions.get('replica_router')
+        if router is not None and not self._flushing:
+            engine = router.engine_for_read()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(PooledSQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class LocalWrites:
+    """When each recent writer's window ends, for this process only."""
+
+    def __init__(self):
+        self._until = {}
+        self._lock = threading.Lock()
+
+    def mark(self, user_ids, until):
+        with self._lock:
+            for user_id in user_ids:
+                self._until[user_id] = until
+            if len(self._until) > 1024:
+                now = time.time()
+                self._until = {
+                    key: deadline for key, deadline in self._until.items()
+                    if deadline > now}
+
+    def until(self, user_id):
+        return self._until.get(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._until.clear()
+
+
+class SharedWrites:
+    """When each recent writer's window ends, for every worker on the host.
+
+    The marks live in a SQLite file, next to the user cache's messages.
+    """
+
+    def __init__(self, path):
+        self._file = _SQLiteFile(
+            path, 'CREATE TABLE IF NOT EXISTS replica_writes ('
+            'user_id INTEGER PRIMARY KEY, until REAL NOT NULL)')
+
+    def mark(self, user_ids, until):
+        connection = self._file.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                'INSERT OR REPLACE INTO replica_writes (user_id, until) '
+                'VALUES (?, ?)', [(user_id, until) for user_id in user_ids])
+            connection.execute(
+                'DELETE FROM replica_writes WHERE until <= ?', (time.time(),))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def until(self, user_id):
+        row = self._file.connection().execute(
+            'SELECT until FROM replica_writes WHERE user_id = ?',
+            (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def clear(self):
+        self._file.connection().execute('DELETE FROM replica_writes')
+
+
+class ReplicaRouter:
+    """Balance reads over the SQLALCHEMY_REPLICA_URIS binds.
+
+    Users who wrote in the last REPLICA_READ_YOUR_WRITES_SECONDS read from
+    the primary, so they see their own changes despite replication lag.
+    With USER_CACHE_PATH set, writers are remembered in that file, so the
+    next request may land on any worker; without it, only the worker that
+    took the write knows.
+    """
+
+    def __init__(self, db, app=None):
+        self.db = db
+        self._writes = None
+        self._writes_path = None
+        self._lock = threading.Lock()
+        self._turns = itertools.count()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        uris = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        keys = []
+        for number, uri in enumerate(uris):
+            key = BIND_PREFIX + str(number)
+            binds[key] = uri
+            keys.append(key)
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+        app.extensions['replica_router'] = self
+        app.extensions['replicas'] = keys
+        app.teardown_request(self._teardown_request)
+
+    @staticmethod
+    def _teardown_request(exception):
+        g.pop('replica_reads', None)
+        g.pop('replica_key', None)
+
+    def choose(self, app):
+        """The bind key of the replica to read from, or None."""
+        keys = app.extensions.get('replicas')
+        if not keys:
+            return None
+        if app.config.get('REPLICA_BALANCING') == 'least_connections':
+            return min(keys, key=lambda key: self.db.get_engine(
+                app, bind=key).pool.in_use)
+        return keys[next(self._turns) % len(keys)]
+
+    def engine_for_read(self):
+        if not has_app_context() or not g.get('replica_reads'):
+            return None
+        identity = g.get('identity')
+        if identity is not None and self.wrote_recently(identity.id):
+            return None
+        app = current_app._get_current_object()
+        # one replica per request, so its queries share a connection
+        key = g.get('replica_key')
+        if key is None:
+            key = self.choose(app)
+            if key is None:
+                return None
+            g.replica_key = key
+        return self.db.get_engine(app, bind=key)
+
+    @contextmanager
+    def reads(self, user_id=None):
+        """Let queries in the block read from a replica."""
+        previous = g.get('replica_reads', False)
+        g.replica_reads = not self.wrote_recently(user_id)
+        try:
+            yield
+        finally:
+            g.replica_reads = previous
+
+    def _marks(self):
+        path = current_app.config.get('USER_CACHE_PATH')
+        if self._writes is None or path != self._writes_path:
+            with self._lock:
+                if self._writes is None or path != self._writes_path:
+                    self._writes = SharedWrites(path) if path else \
+                        LocalWrites()
+                    self._writes_path = path
+        return self._writes
+
+    def wrote(self, *user_ids):
+        """Send reads by these users to the primary for a while."""
+        window = current_app.config.get('REPLICA_READ_YOUR_WRITES_SECONDS')
+        # wall clock time, as other processes compare against it
+        self._marks().mark(user_ids, time.time() + window)
+
+    def wrote_recently(self, user_id):
+        if user_id is None:
+            return False
+        deadline = self._marks().until(user_id)
+        return deadline is not None and deadline > time.time()
+
+    def forget_writes(self):
+        """Drop every write mark, in all workers sharing them."""
+        self._marks().clear()
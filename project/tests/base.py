@@ -1,6 +1,9 @@
+from contextlib import contextmanager
+
 from flask_testing import TestCase
 
-from project import db, create_app
+from project import db, create_app, token_cache, user_cache
+from project.queries import QueryCounter
 
 app = create_app()
 
@@ -10,10 +13,21 @@ class BaseTestCase(TestCase):
 		return app
 
 	def setUp(self):
+		token_cache.clear()
+		user_cache.clear()
 		db.create_all()
 		db.session.commit()
 
 	def tearDown(self):
 		db.session.remove()
 		db.drop_all()
-		
+
+	@contextmanager
+	def assertMaxQueries(self, n):
+		"""Fail if the block runs more than n SQL statements."""
+		with QueryCounter(db.engine) as counter:
+			yield counter
+		if counter.count > n:
+			self.fail('{} queries run, expected at most {}:\n{}'.format(
+				counter.count, n,
+				'\n'.join(statement for statement, _ in counter.statements)))
@@ -1,6 +1,8 @@
 import json
 import time
 
+from flask import g
+
 from project import db
 from project.api.models import User
 from project.tests.base import BaseTestCase
@@ -11,15 +13,16 @@ class TestAuthBlueprint(BaseTestCase):
     
     def test_user_registration(self):
         with self.client:
-            response = self.client.post(
-                '/auth/register',
-                data=json.dumps(dict(
-                    username='justatest',
-                    email='test@test.com',
-                    password='123456'
-                )),
-                content_type='application/json'
-            )
+            with self.assertMaxQueries(3):
+                response = self.client.post(
+                    '/auth/register',
+                    data=json.dumps(dict(
+                        username='justatest',
+                        email='test@test.com',
+                        password='123456'
+                    )),
+                    content_type='application/json'
+                )
             data = json.loads(response.data.decode())
             self.assertTrue(data['status'] == 'success')
             self.assertTrue(data['message'] == 'Successfully registered.')
@@ -44,6 +47,22 @@ class TestAuthBlueprint(BaseTestCase):
             self.assertIn('Sorry. That user already exists.', data['message'])
             self.assertIn('error', data['status'])
 
+    def test_user_registration_duplicate_email_other_case(self):
+        add_user(username='test', email='test@test.com', password='test')
+        with self.client:
+            response = self.client.post(
+                '/auth/register',
+                data=json.dumps(dict(
+                    username='michael',
+                    email='TEST@test.com',
+                    password='test'
+                )),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Sorry. That user already exists.', data['message'])
+
     def test_user_registration_duplicate_username(self):
         add_user('test', 'test@test.com', 'test')
         with self.client:
@@ -113,20 +132,36 @@ class TestAuthBlueprint(BaseTestCase):
     def test_registered_user_login(self):
         with self.client:
             user = add_user('test', 'test@test.com', 'test')
+            with self.assertMaxQueries(1):
+                response = self.client.post(
+                    '/auth/login',
+                    data=json.dumps(dict(
+                        email='test@test.com',
+                        password='test'
+                    )),
+                    content_type='application/json' 
+                )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'success')
+            self.assertTrue(data['message'] == 'Successfully logged in.')
+            self.assertTrue(data['auth_token'])
+            self.assertTrue(response.content_type == 'application/json')
+            self.assertEqual(response.status_code, 200)
+
+    def test_user_login_ignores_email_case(self):
+        add_user('test', 'test@test.com', 'test')
+        with self.client:
             response = self.client.post(
                 '/auth/login',
                 data=json.dumps(dict(
-                    email='test@test.com',
+                    email='Test@Test.com',
                     password='test'
                 )),
-                content_type='application/json' 
+                content_type='application/json'
             )
             data = json.loads(response.data.decode())
-            self.assertTrue(data['status'] == 'success')
-            self.assertTrue(data['message'] == 'Successfully logged in.')
-            self.assertTrue(data['auth_token'])
-            self.assertTrue(response.content_type == 'application/json')
             self.assertEqual(response.status_code, 200)
+            self.assertTrue(data['auth_token'])
 
     def test_not_registered_user_login(self):
         with self.client:
@@ -157,14 +192,15 @@ class TestAuthBlueprint(BaseTestCase):
                 content_type='application/json'
             )
             # valid token logout
-            response = self.client.get(
-                '/auth/logout',
-                headers=dict(
-                    Authorization='Bearer ' + json.loads(
-                        resp_login.data.decode()
-                        )['auth_token']
+            with self.assertMaxQueries(1):
+                response = self.client.get(
+                    '/auth/logout',
+                    headers=dict(
+                        Authorization='Bearer ' + json.loads(
+                            resp_login.data.decode()
+                            )['auth_token']
+                        )
                     )
-                )
             data = json.loads(response.data.decode())
             self.assertTrue(data['status'] == 'success')
             self.assertTrue(data['message'] == 'Successfully logged out.')
@@ -209,6 +245,91 @@ class TestAuthBlueprint(BaseTestCase):
             self.assertEqual(response.status_code, 401)
 
     def test_user_status(self):
+        add_user('test', 'test@test.com', 'test')
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='test@test.com',
+                    password='test'
+                )),
+                content_type='application/json'
+            )
+            with self.assertMaxQueries(1):
+                response = self.client.get(
+                    '/auth/status',
+                    headers=dict(
+                        Authorization='Bearer ' + json.loads(
+                            resp_login.data.decode()
+                        )['auth_token']
+                    )
+                )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'success')
+            self.assertTrue(data['data'] is not None)
+            self.assertTrue(data['data']['username'] == 'test')
+            self.assertTrue(data['data']['email'] == 'test@test.com')
+            self.assertTrue(data['data']['active'] is True)
+            self.assertTrue(data['data']['created_at'])
+            self.assertEqual(response.status_code, 200)
+
+    def test_user_status_fields(self):
+        add_user('test', 'test@test.com', 'test')
+        # a token that outlives the test, so the second status call is
+        # answered from the token cache
+        self.app.config['TOKEN_EXPIRATION_SECONDS'] = 60
+        try:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='test@test.com',
+                    password='test'
+                )),
+                content_type='application/json'
+            )
+            headers = dict(
+                Authorization='Bearer ' + json.loads(
+                    resp_login.data.decode()
+                )['auth_token']
+            )
+            self.client.get('/auth/status', headers=headers)
+            # with no user cache to fill, the only query reads the fields
+            self.app.config['USER_CACHE_BACKEND'] = ''
+            with self.assertMaxQueries(1) as counter:
+                response = self.client.get(
+                    '/auth/status?fields=id,admin', headers=headers)
+        finally:
+            self.app.config.update(
+                TOKEN_EXPIRATION_SECONDS=3, USER_CACHE_BACKEND='memory')
+        self.assertNotIn('users.email', counter.statements[0][0])
+        self.assertNotIn('users.username', counter.statements[0][0])
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(data['data']), {'id', 'admin'})
+        self.assertFalse(data['data']['admin'])
+
+    def test_user_status_conditional_get(self):
+        add_user('test', 'test@test.com', 'test')
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='test@test.com',
+                    password='test'
+                )),
+                content_type='application/json'
+            )
+            headers = dict(Authorization='Bearer ' + json.loads(
+                resp_login.data.decode())['auth_token'])
+            response = self.client.get('/auth/status', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            headers['If-None-Match'] = response.headers['ETag']
+            response = self.client.get('/auth/status', headers=headers)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+
+    def test_user_status_uses_request_user(self):
+        """Ensure the authenticated user is loaded once and kept on g."""
         add_user('test', 'test@test.com', 'test')
         with self.client:
             resp_login = self.client.post(
@@ -228,13 +349,9 @@ class TestAuthBlueprint(BaseTestCase):
                 )
             )
             data = json.loads(response.data.decode())
-            self.assertTrue(data['status'] == 'success')
-            self.assertTrue(data['data'] is not None)
-            self.assertTrue(data['data']['username'] == 'test')
-            self.assertTrue(data['data']['email'] == 'test@test.com')
-            self.assertTrue(data['data']['active'] is True)
-            self.assertTrue(data['data']['created_at'])
             self.assertEqual(response.status_code, 200)
+            self.assertEqual(g.current_user.id, data['data']['id'])
+            self.assertEqual(g.current_user.username, 'test')
 
     def test_invalid_status(self):
         with self.client:
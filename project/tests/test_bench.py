@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import tempfile
+from unittest import mock
+
+from project import config
+from project.api.models import User
+from project.bench.calibrate import calibrate, format_results
+from project.bench.endpoints import compare, uncovered_endpoints
+from project.bench.micro import configured_bcrypt_rounds, measure
+from project.bench.seed import seed_users
+from project.bench.traffic import (
+    HTTPClient, ReplayUsers, build_request, load_recording, recorded_user_ids)
+from project.tests.base import BaseTestCase
+
+
+class TestCalibrateBcrypt(BaseTestCase):
+    """Tests for the bcrypt cost calibration."""
+
+    def test_calibrate_recommends_within_budget(self):
+        results, recommended = calibrate(
+            target_ms=10000, workers=2, samples=1, rounds=range(4, 6))
+        self.assertEqual([r.rounds for r in results], [4, 5])
+        self.assertEqual(recommended, 5)
+        self.assertIn('hashes/s', format_results(results))
+
+    def test_calibrate_stops_past_budget(self):
+        results, recommended = calibrate(
+            target_ms=0, workers=1, samples=1, rounds=range(4, 8))
+        self.assertEqual(len(results), 1)
+        self.assertIsNone(recommended)
+
+
+class TestSeedUsers(BaseTestCase):
+    """Tests for synthetic seeding."""
+
+    def test_seed_users(self):
+        rate = seed_users(25, batch_size=10, seed=1)
+        self.assertTrue(rate > 0)
+        self.assertEqual(User.query.count(), 25)
+        users = User.query.all()
+        self.assertEqual(len({user.email for user in users}), 25)
+        self.assertEqual(len({user.password for user in users}), 1)
+        self.assertTrue(len({user.created_at for user in users}) > 1)
+
+
+class TestEndpointBench(BaseTestCase):
+    """Tests for the endpoint benchmark suite."""
+
+    def test_every_endpoint_is_benchmarked(self):
+        self.assertEqual(uncovered_endpoints(self.app), [])
+
+    def test_compare_flags_regressions(self):
+        baseline = {
+            'GET /ping': {'p95_ms': 1.0, 'queries_per_request': 0.0},
+            'GET /users': {'p95_ms': 10.0, 'queries_per_request': 2.0},
+        }
+        results = {
+            'GET /ping': {'p95_ms': 1.1, 'queries_per_request': 0.0},
+            'GET /users': {'p95_ms': 20.0, 'queries_per_request': 3.0},
+        }
+        regressions = compare(results, baseline, threshold=0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(all(r.startswith('GET /users:') for r in regressions))
+
+
+class TestMicroBench(BaseTestCase):
+    """Tests for the auth micro-benchmarks."""
+
+    def test_configured_bcrypt_rounds(self):
+        # BaseConfig reads BCRYPT_LOG_ROUNDS from the environment
+        with mock.patch.object(config.BaseConfig, 'BCRYPT_LOG_ROUNDS', 12):
+            self.assertEqual(configured_bcrypt_rounds(), [4, 12])
+
+    def test_measure(self):
+        result = measure(lambda: [0] * 1000, iterations=10, repeat=2)
+        self.assertEqual(result['iterations'], 10)
+        self.assertTrue(result['ops_per_sec'] > 0)
+        self.assertTrue(result['peak_bytes_per_op'] >= 8000)
+
+
+class TestTrafficRecording(BaseTestCase):
+    """Tests for request recording and replay request building."""
+
+    def test_record_and_build_request(self):
+        path = tempfile.mktemp(suffix='.ndjson')
+        self.app.config['TRAFFIC_RECORD_FILE'] = path
+        try:
+            self.client.post(
+                '/auth/register',
+                data=json.dumps(dict(
+                    username='test', email='test@test.com', password='test')),
+                content_type='application/json')
+            self.client.get('/users/1')
+            entries = load_recording(path)
+        finally:
+            self.app.config['TRAFFIC_RECORD_FILE'] = None
+            if os.path.exists(path):
+                os.remove(path)
+        self.assertEqual(len(entries), 2)
+        register, single = entries
+        self.assertEqual(register['rule'], '/auth/register')
+        self.assertEqual(register['body'], {
+            'username': 'str', 'email': 'str', 'password': 'str'})
+        self.assertNotIn('test@test.com', json.dumps(entries))
+        self.assertEqual(single['view_args'], {'user_id': '1'})
+
+        method, path, headers, body = build_request(
+            register, 7, ReplayUsers(run_id=1))
+        self.assertEqual((method, path), ('POST', '/auth/register'))
+        self.assertEqual(json.loads(body.decode())['email'],
+                         'replay7@replay.example.com')
+        self.assertNotIn('Authorization', headers)
+
+    def test_ids_map_onto_replay_accounts(self):
+        """Ensure replayed requests only reach the replay's own accounts."""
+        entry = dict(
+            method='DELETE', rule='/users/<user_id>', view_args={'user_id': '9'},
+            query=[], body=None, auth_user=5, auth_admin=True)
+        self.assertEqual(recorded_user_ids([entry]), {0, 5, 9})
+        users = ReplayUsers(run_id=1)
+        users.ids = {0: 100, 5: 105, 9: 109}
+        self.assertEqual(
+            build_request(entry, 1, users)[:2], ('DELETE', '/users/109'))
+        entry['view_args'] = {'user_id': '42'}
+        self.assertEqual(build_request(entry, 1, users)[1], '/users/0')
+
+
+class TestHTTPClient(BaseTestCase):
+    """Tests for the replay's HTTP client against a scripted server."""
+
+    RESPONSES = {
+        '/length': b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello',
+        '/chunked': (b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                     b'5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n'),
+        '/close': b'HTTP/1.1 200 OK\r\nConnection: close\r\n\r\nbye',
+        # answer, then drop the connection as an idle timeout would
+        '/drop': b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok',
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.saved_loop = asyncio.get_event_loop()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.connections = 0
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self.handle, '127.0.0.1', 0))
+        port = self.server.sockets[0].getsockname()[1]
+        self.client = HTTPClient('http://127.0.0.1:{}'.format(port))
+
+    def tearDown(self):
+        self.client.close()
+        # let the handlers see the client go
+        self.loop.run_until_complete(
+            asyncio.gather(*asyncio.Task.all_tasks(self.loop)))
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        asyncio.set_event_loop(self.saved_loop)
+        super().tearDown()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                key, _, value = line.decode().partition(':')
+                if key.lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            path = request_line.split()[1].decode()
+            if path in self.RESPONSES:
+                writer.write(self.RESPONSES[path])
+                await writer.drain()
+            if path not in ('/length', '/chunked'):
+                break
+        writer.close()
+
+    def request(self, path):
+        return self.loop.run_until_complete(self.client.request('GET', path))
+
+    def test_bodies(self):
+        self.assertEqual(self.request('/length'), (200, b'hello'))
+        self.assertEqual(self.request('/chunked'), (200, b'hello world'))
+        self.assertEqual(self.connections, 1)
+        self.assertEqual(self.request('/close'), (200, b'bye'))
+        self.assertEqual(self.request('/length'), (200, b'hello'))
+        self.assertEqual(self.connections, 2)
+
+    def test_retries_once_on_a_closed_connection(self):
+        self.assertEqual(self.request('/drop'), (200, b'ok'))
+        self.assertEqual(self.request('/length'), (200, b'hello'))
+        self.assertEqual(self.connections, 2)
+        # the server hangs up without answering, on the retry as well
+        self.assertEqual(self.request('/drop'), (200, b'ok'))
+        with self.assertRaises(ConnectionError):
+            self.request('/hang-up')
+        self.assertEqual(self.connections, 3)
@@ -0,0 +1,105 @@
+import gzip
+import json
+import unittest
+import zlib
+
+from project import db
+from project.api.models import User
+from project.compression import ENCODERS, zstandard
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+class TestCompression(BaseTestCase):
+    """Tests for response compression."""
+
+    def setUp(self):
+        super().setUp()
+        add_user('admin', 'admin@admin.com', 'admin')
+        User.query.filter_by(username='admin').first().admin = True
+        db.session.commit()
+        for number in range(30):
+            add_user('user{}'.format(number),
+                     'user{}@test.com'.format(number), 'pass')
+        resp_login = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(email='admin@admin.com', password='admin')),
+            content_type='application/json'
+        )
+        self.token = json.loads(resp_login.data.decode())['auth_token']
+
+    def tearDown(self):
+        self.app.config['COMPRESS_STREAM_FLUSH_SIZE'] = 64 * 1024
+        super().tearDown()
+
+    def get(self, url, **headers):
+        headers['Authorization'] = 'Bearer ' + self.token
+        return self.client.get(url, headers=headers)
+
+    def test_gzip(self):
+        """Ensure a large response is gzipped for a client that accepts it."""
+        plain = self.get('/users')
+        response = self.get('/users', **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+        self.assertLess(len(response.data), len(plain.data))
+        self.assertEqual(int(response.headers['Content-Length']),
+                         len(response.data))
+
+    def test_client_preference(self):
+        """Ensure the encoding the client rates highest is picked."""
+        response = self.get(
+            '/users', **{'Accept-Encoding': 'gzip;q=0.5, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+        self.assertIn(b'user29', zlib.decompress(response.data))
+        response = self.get('/users', **{'Accept-Encoding': 'br'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_small_response_is_not_compressed(self):
+        response = self.client.get('/ping', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn(b'pong', response.data)
+
+    def test_encoded_etag(self):
+        """Ensure the gzipped representation has its own, reusable ETag."""
+        plain = self.get('/users')
+        response = self.get('/users', **{'Accept-Encoding': 'gzip'})
+        etag = response.headers['ETag']
+        self.assertEqual(etag, plain.headers['ETag'][:-1] + '-gzip"')
+        response = self.get('/users', **{
+            'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        response = self.get('/users', **{'If-None-Match': plain.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], plain.headers['ETag'])
+
+    def test_stream_is_compressed_incrementally(self):
+        """Ensure a streamed body is compressed in pieces, not buffered."""
+        self.app.config['COMPRESS_STREAM_FLUSH_SIZE'] = 1
+        response = self.client.get(
+            '/users?stream=1', buffered=False, headers={
+                'Authorization': 'Bearer ' + self.token,
+                'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response.headers)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pieces = iter(response.response)
+        # every piece can be decoded as soon as it arrives
+        first_line = json.loads(
+            decompressor.decompress(next(pieces)).decode().splitlines()[0])
+        self.assertIn('username', first_line)
+        body = b''.join(decompressor.decompress(piece) for piece in pieces)
+        response.close()
+        self.assertEqual(len(body.decode().splitlines()), 30)
+
+    @unittest.skipIf(zstandard is None, 'zstandard missing')
+    def test_zstd(self):
+        response = self.get('/users', **{'Accept-Encoding': 'gzip, zstd'})
+        self.assertEqual(response.headers['Content-Encoding'], 'zstd')
+        self.assertIn(b'user29', zstandard.ZstdDecompressor().decompress(
+            response.data, max_output_size=1 << 20))
+
+    def test_zstd_needs_package(self):
+        self.assertEqual('zstd' in ENCODERS, zstandard is not None)
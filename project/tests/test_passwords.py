@@ -0,0 +1,148 @@
+import json
+import threading
+import unittest
+from unittest import mock
+
+from sqlalchemy import exc
+
+from project import db, password_pool, passwords
+from project.api.models import User
+from project.api.passwords import (
+    PasswordPool, PasswordPoolBusy, ScryptHasher)
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+class TestPasswordPool(BaseTestCase):
+    """Tests for the password hashing pool."""
+
+    def test_pool_rejects_when_full(self):
+        """Ensure work past the workers and queue is rejected, not queued."""
+        self.app.config['PASSWORD_POOL_WORKERS'] = 1
+        self.app.config['PASSWORD_POOL_QUEUE_SIZE'] = 1
+        try:
+            pool = PasswordPool(self.app)
+            release = threading.Event()
+            running = pool.submit(release.wait)
+            queued = pool.submit(release.wait)
+            self.assertRaises(PasswordPoolBusy, pool.submit, release.wait)
+            release.set()
+            running.result()
+            queued.result()
+            self.assertTrue(pool.run(lambda: True))
+        finally:
+            self.app.config['PASSWORD_POOL_WORKERS'] = 2
+            self.app.config['PASSWORD_POOL_QUEUE_SIZE'] = 16
+
+    def test_bulk_work_leaves_room_for_logins(self):
+        """Ensure batch jobs take only their share of the pool."""
+        self.app.config['PASSWORD_POOL_WORKERS'] = 2
+        self.app.config['PASSWORD_POOL_QUEUE_SIZE'] = 1
+        try:
+            pool = PasswordPool(self.app)
+            release = threading.Event()
+            batch = threading.Thread(target=lambda: [
+                pool.submit_bulk(release.wait) for _ in range(3)])
+            batch.start()
+            batch.join(0.1)
+            # one batch job runs, the others wait outside the pool
+            self.assertTrue(batch.is_alive())
+            logins = [pool.submit(release.wait), pool.submit(release.wait)]
+            self.assertRaises(PasswordPoolBusy, pool.submit, release.wait)
+            release.set()
+            batch.join(5)
+            for future in logins:
+                future.result()
+        finally:
+            release.set()
+            self.app.config['PASSWORD_POOL_WORKERS'] = 2
+            self.app.config['PASSWORD_POOL_QUEUE_SIZE'] = 16
+
+    def test_login_when_pool_is_busy(self):
+        """Ensure login sheds load with a 503 and Retry-After."""
+        add_user('test', 'test@test.com', 'test')
+        with mock.patch.object(
+                password_pool, 'submit', side_effect=PasswordPoolBusy):
+            response = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='test@test.com',
+                    password='test'
+                )),
+                content_type='application/json'
+            )
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(data['status'], 'error')
+
+
+class TestPasswordHasher(BaseTestCase):
+    """Tests for the pluggable password hasher."""
+
+    def test_login_rehashes_outdated_cost(self):
+        """Ensure a login upgrades a hash made with an old bcrypt cost."""
+        add_user('test', 'test@test.com', 'test')
+        self.app.config['BCRYPT_LOG_ROUNDS'] = 5
+        try:
+            response = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='test@test.com',
+                    password='test'
+                )),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 200)
+            user = User.query.filter_by(email='test@test.com').first()
+            self.assertTrue(user.password.startswith('$2b$05$'))
+            self.assertFalse(passwords.needs_rehash(user.password))
+            self.assertTrue(passwords.verify(user.password, 'test'))
+        finally:
+            self.app.config['BCRYPT_LOG_ROUNDS'] = 4
+
+    def test_login_survives_failed_rehash(self):
+        """Ensure a database error while upgrading a hash is not fatal."""
+        add_user('test', 'test@test.com', 'test')
+        self.app.config['BCRYPT_LOG_ROUNDS'] = 5
+        error = exc.OperationalError('UPDATE users', {}, Exception('locked'))
+        try:
+            with mock.patch.object(db.session, 'commit', side_effect=error), \
+                    self.assertLogs(self.app.logger, 'WARNING'):
+                response = self.client.post(
+                    '/auth/login',
+                    data=json.dumps(dict(
+                        email='test@test.com',
+                        password='test'
+                    )),
+                    content_type='application/json'
+                )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(data['auth_token'])
+            user = User.query.filter_by(email='test@test.com').first()
+            self.assertTrue(user.password.startswith('$2b$04$'))
+        finally:
+            self.app.config['BCRYPT_LOG_ROUNDS'] = 4
+
+    def test_unknown_scheme_does_not_verify(self):
+        self.assertFalse(passwords.verify('$argon2id$whatever', 'test'))
+        self.assertTrue(passwords.needs_rehash('$argon2id$whatever'))
+
+    @unittest.skipUnless(ScryptHasher.available(), 'hashlib.scrypt missing')
+    def test_scrypt_scheme(self):
+        """Ensure scrypt hashes verify and bcrypt hashes are upgraded."""
+        bcrypt_hash = passwords.hash('test')
+        self.app.config['PASSWORD_SCHEME'] = 'scrypt'
+        self.app.config['SCRYPT_LOG_N'] = 10
+        try:
+            self.assertTrue(passwords.needs_rehash(bcrypt_hash))
+            self.assertTrue(passwords.verify(bcrypt_hash, 'test'))
+            hashed = passwords.hash('test')
+            self.assertTrue(hashed.startswith('$scrypt$ln=10,r=8,p=1$'))
+            self.assertTrue(passwords.verify(hashed, 'test'))
+            self.assertFalse(passwords.verify(hashed, 'nope'))
+            self.assertFalse(passwords.needs_rehash(hashed))
+        finally:
+            self.app.config['PASSWORD_SCHEME'] = 'bcrypt'
+            self.app.config['SCRYPT_LOG_N'] = 14
@@ -0,0 +1,82 @@
+import sqlite3
+import threading
+
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+from project import db
+from project.pool import MonitoredPool, monitored, ping_connection
+from project.tests.base import BaseTestCase
+
+
+class TestConnectionPool(BaseTestCase):
+    """Tests for pool configuration and monitoring."""
+
+    def engine_options(self, uri, **config):
+        saved = {key: self.app.config.get(key) for key in config}
+        self.app.config.update(config)
+        try:
+            options = {}
+            db.apply_pool_defaults(self.app, options)
+            db.apply_driver_hacks(self.app, make_url(uri), options)
+        finally:
+            self.app.config.update(saved)
+        return options
+
+    def test_queue_pool_settings(self):
+        options = self.engine_options(
+            'postgresql://postgres@localhost/users',
+            SQLALCHEMY_POOL_SIZE=7, SQLALCHEMY_POOL_PRE_PING=True)
+        self.assertTrue(issubclass(options['poolclass'], QueuePool))
+        self.assertTrue(issubclass(options['poolclass'], MonitoredPool))
+        self.assertEqual(options['pool_size'], 7)
+        self.assertIn((ping_connection, 'checkout'), options['pool_events'])
+
+    def test_pgbouncer_uses_null_pool(self):
+        options = self.engine_options(
+            'postgresql://postgres@pgbouncer/users',
+            SQLALCHEMY_PGBOUNCER=True, SQLALCHEMY_POOL_PRE_PING=True)
+        self.assertTrue(issubclass(options['poolclass'], NullPool))
+        for key in ('pool_size', 'max_overflow', 'pool_timeout'):
+            self.assertNotIn(key, options)
+        self.assertNotIn('pool_events', options)
+
+    def test_checkout_is_measured(self):
+        before = REGISTRY.get_sample_value(
+            'db_pool_checkout_wait_seconds_count')
+        in_use = REGISTRY.get_sample_value('db_pool_connections_in_use')
+        with db.engine.connect():
+            self.assertEqual(
+                REGISTRY.get_sample_value('db_pool_connections_in_use'),
+                in_use + 1)
+        self.assertEqual(
+            REGISTRY.get_sample_value('db_pool_connections_in_use'), in_use)
+        self.assertEqual(
+            REGISTRY.get_sample_value('db_pool_checkout_wait_seconds_count'),
+            before + 1)
+
+    def test_in_use_survives_concurrent_checkouts(self):
+        engine = create_engine(
+            'sqlite://', poolclass=monitored(QueuePool), pool_size=4,
+            max_overflow=4, connect_args={'check_same_thread': False})
+
+        def work():
+            for _ in range(200):
+                engine.connect().close()
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(engine.pool.in_use, 0)
+        engine.dispose()
+
+    def test_ping_rejects_dead_connection(self):
+        connection = sqlite3.connect(':memory:')
+        ping_connection(connection, None, None)
+        connection.close()
+        with self.assertRaises(exc.DisconnectionError):
+            ping_connection(connection, None, None)
@@ -0,0 +1,89 @@
+from project import db
+from project.api.models import User
+from project.indexes import HOT_QUERIES, check_indexes, index_backed, plan
+from project.queries import statement_shape
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+class TestQueryInspector(BaseTestCase):
+    """Tests for per-request SQL statistics."""
+
+    def test_query_count_header(self):
+        user = add_user('michael', 'michael@realpython.com', 'pass')
+        response = self.client.get('/users/{}'.format(user.id))
+        self.assertEqual(response.headers['X-Query-Count'], '1')
+        self.assertIn('X-Query-Time-Ms', response.headers)
+        response = self.client.get('/ping')
+        self.assertEqual(response.headers['X-Query-Count'], '0')
+
+    def test_repeated_statement_warning(self):
+        """Ensure the same statement shape run too often is reported."""
+        users = [add_user('user{}'.format(n), 'user{}@test.com'.format(n),
+                          'pass') for n in range(3)]
+        ids = [user.id for user in users]
+        self.app.config['SQL_REPEAT_THRESHOLD'] = 2
+        try:
+            with self.app.test_request_context('/users'):
+                self.app.preprocess_request()
+                for user_id in ids:
+                    db.session.query(User).filter_by(id=user_id).first()
+                with self.assertLogs(self.app.logger, 'WARNING') as logs:
+                    self.app.process_response(self.app.response_class())
+        finally:
+            self.app.config['SQL_REPEAT_THRESHOLD'] = 5
+        self.assertIn('ran 3 times', logs.output[0])
+
+    def test_slow_query_is_logged_with_plan(self):
+        self.app.config['SLOW_QUERY_MS'] = 0
+        try:
+            with self.app.test_request_context('/users/1'):
+                self.app.preprocess_request()
+                with self.assertLogs(self.app.logger, 'WARNING') as logs:
+                    User.query.filter_by(id=1).first()
+        finally:
+            self.app.config['SLOW_QUERY_MS'] = 200
+        self.assertIn('Slow query', logs.output[0])
+        self.assertIn('Plan:', logs.output[0])
+        self.assertIn('users', logs.output[0].split('Plan:')[1])
+
+    def test_statement_shape_collapses_in_lists(self):
+        self.assertEqual(
+            statement_shape('SELECT * FROM users WHERE id IN (?, ?,\n ?)'),
+            statement_shape('SELECT * FROM users WHERE id IN (?)'))
+
+    def test_hot_queries_are_index_backed(self):
+        results = check_indexes(db.session)
+        self.assertTrue(results)
+        for name, query_plan, ok in results:
+            self.assertTrue(ok, '{}:\n{}'.format(name, query_plan))
+
+    def test_next_page_seeks_into_index(self):
+        """Ensure a later page starts at the cursor, not the first row."""
+        query_plan = plan(db.session.connection(),
+                          HOT_QUERIES['GET /users: next page']())
+        self.assertIn('SEARCH users USING INDEX ix_users_created_at_id',
+                      query_plan)
+
+    def test_walking_an_index_is_not_a_seek(self):
+        """Ensure a full index scan does not pass for an index lookup."""
+        self.assertFalse(index_backed(
+            'sqlite', '4 0 0 SCAN users USING INDEX ix_users_created_at_id'))
+        self.assertTrue(index_backed(
+            'sqlite', '4 0 0 SCAN users USING INDEX ix_users_created_at_id',
+            seeks=False))
+        self.assertFalse(index_backed(
+            'postgresql', 'Limit\n  ->  Index Scan using ix_users_created_at_id'
+            ' on users\n        Filter: (created_at < now())'))
+        self.assertTrue(index_backed(
+            'postgresql', 'Limit\n  ->  Index Scan Backward using '
+            'ix_users_created_at_id on users\n        Index Cond: '
+            '(ROW(created_at, id) < ROW(now(), 1))'))
+
+    def test_missing_index_is_reported(self):
+        db.session.execute('DROP INDEX ix_users_email_lower')
+        db.session.commit()
+        failed = [name for name, _, ok in check_indexes(db.session) if not ok]
+        self.assertEqual(
+            failed, ['login: user by email',
+                     'register: existing username or email'])
@@ -0,0 +1,118 @@
+import datetime
+import json
+
+from project import db, replicas, token_cache, user_cache
+from project.api.models import User
+from project.replicas import ReplicaRouter
+from project.tests.base import BaseTestCase
+
+
+REPLICAS = ['replica_0', 'replica_1']
+
+
+class TestReplicaRouting(BaseTestCase):
+    """Tests for sending reads to replicas."""
+
+    def setUp(self):
+        super().setUp()
+        self.saved_binds = self.app.config['SQLALCHEMY_BINDS']
+        self.app.config['SQLALCHEMY_BINDS'] = {
+            key: 'sqlite://' for key in REPLICAS}
+        self.app.extensions['replicas'] = REPLICAS
+        for key in REPLICAS:
+            db.metadata.create_all(bind=self.replica(key))
+        replicas.forget_writes()
+
+    def tearDown(self):
+        db.session.remove()
+        for key in REPLICAS:
+            db.metadata.drop_all(bind=self.replica(key))
+        self.app.config['SQLALCHEMY_BINDS'] = self.saved_binds
+        self.app.extensions['replicas'] = []
+        self.app.config['REPLICA_BALANCING'] = 'round_robin'
+        super().tearDown()
+
+    def replica(self, key):
+        return db.get_engine(self.app, bind=key)
+
+    def add_replica_user(self, key, username):
+        self.replica(key).execute(
+            User.__table__.insert(), id=1, username=username,
+            email=username + '@test.com', password='pass', active=True,
+            admin=False, created_at=datetime.datetime.utcnow())
+
+    def test_read_only_view_reads_replicas_in_turn(self):
+        self.add_replica_user('replica_0', 'zero')
+        self.add_replica_user('replica_1', 'one')
+        usernames = set()
+        for _ in REPLICAS:
+            user_cache.clear()
+            response = self.client.get('/users/1')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            usernames.add(data['data']['username'])
+        self.assertEqual(usernames, {'zero', 'one'})
+
+    def test_writer_reads_own_writes(self):
+        response = self.client.post(
+            '/auth/register',
+            data=json.dumps(dict(
+                username='justatest',
+                email='test@test.com',
+                password='123456'
+            )),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        headers = dict(Authorization='Bearer ' + json.loads(
+            response.data.decode())['auth_token'])
+        # the new user is only on the primary
+        response = self.client.get('/auth/status', headers=headers)
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['data']['username'], 'justatest')
+        # once the window has passed, the lookup goes to a replica
+        replicas.forget_writes()
+        token_cache.clear()
+        response = self.client.get('/auth/status', headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_write_marks_reach_other_workers(self):
+        """Ensure a write in one worker sends reads to the primary in all."""
+        saved = {key: self.app.config[key] for key in (
+            'REPLICA_READ_YOUR_WRITES_SECONDS', 'USER_CACHE_PATH')}
+        writer, reader = ReplicaRouter(db), ReplicaRouter(db)
+        try:
+            writer.wrote(7)
+            self.assertTrue(reader.wrote_recently(7))
+            self.assertFalse(reader.wrote_recently(8))
+            self.app.config['REPLICA_READ_YOUR_WRITES_SECONDS'] = -1
+            writer.wrote(8)
+            self.assertFalse(reader.wrote_recently(8))
+            # without the file, marks stay in the process that made them
+            self.app.config.update(
+                REPLICA_READ_YOUR_WRITES_SECONDS=5, USER_CACHE_PATH=None)
+            writer.wrote(9)
+            self.assertTrue(writer.wrote_recently(9))
+            self.assertFalse(reader.wrote_recently(9))
+        finally:
+            self.app.config.update(saved)
+
+    def test_writes_go_to_primary(self):
+        with self.app.test_request_context('/users/1'):
+            with replicas.reads():
+                db.session.add(User('michael', 'michael@realpython.com',
+                                    'pass'))
+                db.session.commit()
+        self.assertEqual(User.query.count(), 1)
+        for key in REPLICAS:
+            self.assertEqual(
+                self.replica(key).execute('SELECT count(*) FROM users')
+                .scalar(), 0)
+
+    def test_least_connections(self):
+        self.app.config['REPLICA_BALANCING'] = 'least_connections'
+        with self.replica('replica_0').connect():
+            self.assertEqual(replicas.choose(self.app), 'replica_1')
+        with self.replica('replica_1').connect():
+            self.assertEqual(replicas.choose(self.app), 'replica_0')
@@ -0,0 +1,121 @@
+import json
+import time
+from unittest import mock
+
+from project import db, token_cache, user_cache
+from project.api.cache import Identity, UserCache
+from project.api.models import User
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+class TestTokenCache(BaseTestCase):
+    """Tests for the verified token cache."""
+
+    def login(self, email, password):
+        resp_login = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(email=email, password=password)),
+            content_type='application/json'
+        )
+        return json.loads(resp_login.data.decode())['auth_token']
+
+    def test_cached_token_skips_verification(self):
+        """Ensure a repeated token is not decoded a second time."""
+        add_user('test', 'test@test.com', 'test')
+        # the testing token lives 3 s; one that outlives the test keeps
+        # the cache entry from expiring between the two requests
+        self.app.config['TOKEN_EXPIRATION_SECONDS'] = 60
+        try:
+            with self.client:
+                token = self.login('test@test.com', 'test')
+                headers = dict(Authorization='Bearer ' + token)
+                self.client.get('/auth/logout', headers=headers)
+                with mock.patch.object(
+                        User, 'decode_auth_payload',
+                        side_effect=AssertionError('token was decoded')):
+                    response = self.client.get(
+                        '/auth/logout', headers=headers)
+                self.assertEqual(response.status_code, 200)
+        finally:
+            self.app.config['TOKEN_EXPIRATION_SECONDS'] = 3
+
+    def test_entry_expires_with_token(self):
+        """Ensure an entry never outlives the token's exp claim."""
+        token_cache.set('token', Identity(1, True, False), time.time() - 1)
+        self.assertIsNone(token_cache.get('token'))
+
+    def test_cache_is_bounded(self):
+        """Ensure the least recently used entry is evicted first."""
+        self.app.config['TOKEN_CACHE_SIZE'] = 2
+        try:
+            exp = time.time() + 60
+            token_cache.set('one', Identity(1, True, False), exp)
+            token_cache.set('two', Identity(2, True, False), exp)
+            token_cache.get('one')
+            token_cache.set('three', Identity(3, True, False), exp)
+            self.assertEqual(len(token_cache), 2)
+            self.assertIsNone(token_cache.get('two'))
+            self.assertIsNotNone(token_cache.get('one'))
+        finally:
+            self.app.config['TOKEN_CACHE_SIZE'] = 10000
+
+    def test_deleted_user_token_is_rejected(self):
+        """Ensure deleting a user drops their cached tokens."""
+        add_user('admin', 'admin@admin.com', 'admin')
+        user = User.query.filter_by(email='admin@admin.com').first()
+        user.admin = True
+        db.session.commit()
+        deleteme = add_user('deleteme', 'deleteme@deleteme.com', 'deleteme')
+        deleteme_id = deleteme.id
+        with self.client:
+            admin_token = self.login('admin@admin.com', 'admin')
+            token = self.login('deleteme@deleteme.com', 'deleteme')
+            headers = dict(Authorization='Bearer ' + token)
+            response = self.client.get('/auth/status', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.client.delete(
+                '/users/{}'.format(deleteme_id),
+                headers=dict(Authorization='Bearer ' + admin_token)
+            )
+            response = self.client.get('/auth/status', headers=headers)
+            self.assertEqual(response.status_code, 401)
+
+    def delete_behind_our_back(self, user_id):
+        """Delete a user the way another worker would: not through us."""
+        User.query.filter_by(id=user_id).delete()
+        db.session.commit()
+        user_cache.clear()
+
+    def test_user_deleted_elsewhere_gets_401(self):
+        """Ensure a cached token of a since deleted user is not served."""
+        user = add_user('test', 'test@test.com', 'test')
+        user_id = user.id
+        headers = dict(Authorization='Bearer ' + self.login(
+            'test@test.com', 'test'))
+        self.assertEqual(
+            self.client.get('/auth/status', headers=headers).status_code, 200)
+        self.delete_behind_our_back(user_id)
+        response = self.client.get('/auth/status', headers=headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertIsNone(token_cache.get(headers['Authorization'][7:]))
+
+    def test_invalidation_from_other_worker_drops_tokens(self):
+        """Ensure a broadcast invalidation empties this worker's entries."""
+        self.app.config['USER_CACHE_SYNC_SECONDS'] = 0
+        try:
+            add_user('test', 'test@test.com', 'test')
+            token = self.login('test@test.com', 'test')
+            headers = dict(Authorization='Bearer ' + token)
+            self.client.get('/auth/logout', headers=headers)
+            identity = token_cache.get(token)
+            self.assertIsNotNone(identity)
+            UserCache().invalidate(identity.id)
+            with mock.patch.object(
+                    User, 'decode_auth_payload',
+                    wraps=User.decode_auth_payload) as decode:
+                response = self.client.get('/auth/logout', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(decode.called)
+        finally:
+            self.app.config['USER_CACHE_SYNC_SECONDS'] = 0.1
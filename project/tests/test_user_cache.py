@@ -0,0 +1,240 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from prometheus_client import REGISTRY
+
+from project import db, replicas, user_cache
+from project.api.cache import SharedBackend, SingleFlight, UserCache
+from project.api.serializers import UserView
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+def make_user(user_id):
+    now = datetime.datetime(2017, 1, 1, 12, 30, 0, 123456)
+    return UserView(user_id, 'user{}'.format(user_id),
+                    'user{}@test.com'.format(user_id), True, False, now, now)
+
+
+class CountingEvent(threading.Event):
+
+    def __init__(self):
+        super().__init__()
+        self.waiting = 0
+
+    def wait(self, timeout=None):
+        self.waiting += 1
+        return super().wait(timeout)
+
+
+class TestUserCache(BaseTestCase):
+    """Tests for the cache of user rows."""
+
+    def setUp(self):
+        super().setUp()
+        self.saved = {key: self.app.config[key] for key in (
+            'USER_CACHE_BACKEND', 'USER_CACHE_PATH', 'USER_CACHE_SIZE',
+            'USER_CACHE_SYNC_SECONDS')}
+        self.directory = tempfile.mkdtemp()
+        # rows of recent writers are never cached
+        replicas.forget_writes()
+
+    def tearDown(self):
+        self.app.config.update(self.saved)
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def admin_headers(self):
+        add_user('admin', 'admin@admin.com', 'admin').admin = True
+        db.session.commit()
+        response = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(email='admin@admin.com', password='admin')),
+            content_type='application/json'
+        )
+        token = json.loads(response.data.decode())['auth_token']
+        return dict(Authorization='Bearer ' + token)
+
+    def test_cached_user_skips_database(self):
+        """Ensure a second GET of the same user is served from the cache."""
+        user = add_user('michael', 'michael@realpython.com', 'michaelherman')
+        url = '/users/{}'.format(user.id)
+        self.client.get(url)
+        with self.assertMaxQueries(0):
+            response = self.client.get(url)
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['data']['username'], 'michael')
+
+    def test_modify_invalidates_entry(self):
+        """Ensure an updated user is not served from a stale entry."""
+        user = add_user('michael', 'michael@realpython.com', 'michaelherman')
+        url = '/users/{}'.format(user.id)
+        headers = self.admin_headers()
+        self.client.get(url)
+        response = self.client.put(
+            url, data=json.dumps(dict(
+                username='mike', email='michael@realpython.com')),
+            content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(self.client.get(url).data.decode())
+        self.assertEqual(data['data']['username'], 'mike')
+
+    def test_delete_invalidates_entry(self):
+        """Ensure a deleted user is no longer served."""
+        user = add_user('michael', 'michael@realpython.com', 'michaelherman')
+        url = '/users/{}'.format(user.id)
+        headers = self.admin_headers()
+        self.client.get(url)
+        self.client.delete(url, headers=headers)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_eviction_is_counted(self):
+        """Ensure the least recently used entry goes first and is counted."""
+        self.app.config['USER_CACHE_SIZE'] = 2
+        before = REGISTRY.get_sample_value('user_cache_evictions_total') or 0
+        for user_id in (1, 2, 3):
+            user_cache.set(make_user(user_id))
+        self.assertIsNone(user_cache.get(1))
+        self.assertEqual(user_cache.get(3), make_user(3))
+        self.assertEqual(
+            REGISTRY.get_sample_value('user_cache_evictions_total'),
+            before + 1)
+
+    def test_shared_backend_round_trip(self):
+        """Ensure entries survive the trip through the shared file."""
+        path = os.path.join(self.directory, 'cache.db')
+        backend = SharedBackend(path, 2)
+        expires_at = time.time() + 60
+        backend.set(1, make_user(1), expires_at)
+        self.assertEqual(SharedBackend(path, 2).get(1), make_user(1))
+        backend.set(2, make_user(2), time.time() + 120)
+        self.assertEqual(backend.set(3, make_user(3), time.time() + 180), 1)
+        self.assertIsNone(backend.get(1))
+        backend.set(4, make_user(4), time.time() - 1)
+        self.assertIsNone(backend.get(4))
+
+    def test_backends_need_path(self):
+        """Ensure no backend runs without the invalidation channel."""
+        for backend in ('memory', 'shared'):
+            self.app.config.update(
+                USER_CACHE_BACKEND=backend, USER_CACHE_PATH=None)
+            with self.assertRaises(RuntimeError):
+                UserCache().get(1)
+        self.app.config.update(USER_CACHE_BACKEND='')
+        self.assertIsNone(UserCache().get(1))
+
+    def test_row_read_before_invalidation_is_not_stored(self):
+        """Ensure a reader cannot put back a row invalidated meanwhile."""
+        for backend in ('memory', 'shared'):
+            self.app.config.update(
+                USER_CACHE_BACKEND=backend, USER_CACHE_SYNC_SECONDS=0,
+                USER_CACHE_PATH=os.path.join(
+                    self.directory, backend + '.db'))
+            reader, writer = UserCache(), UserCache()
+            position = reader.position()
+            writer.invalidate(1)
+            reader.set(make_user(1), position)
+            self.assertIsNone(reader.get(1))
+            reader.set(make_user(1), reader.position())
+            self.assertEqual(reader.get(1), make_user(1))
+
+    def test_invalidation_reaches_other_workers(self):
+        """Ensure an invalidation in one worker clears another's entry."""
+        self.app.config.update(
+            USER_CACHE_BACKEND='memory', USER_CACHE_SYNC_SECONDS=0,
+            USER_CACHE_PATH=os.path.join(self.directory, 'cache.db'))
+        writer, reader = UserCache(), UserCache()
+        reader.set(make_user(1))
+        writer.get(1)
+        self.assertEqual(reader.get(1), make_user(1))
+        writer.invalidate(1)
+        self.assertIsNone(reader.get(1))
+
+
+class TestSingleFlight(BaseTestCase):
+    """Tests for coalescing concurrent lookups."""
+
+    def setUp(self):
+        super().setUp()
+        self.flights = SingleFlight()
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def slow_lookup(self, error=None):
+        def lookup():
+            self.calls += 1
+            self.started.set()
+            self.release.wait(5)
+            if error is not None:
+                raise error
+            return make_user(1)
+        return lookup
+
+    def run_concurrently(self, lookup, followers=4, timeout=5):
+        """Start one call, then ``followers`` more while it is in flight."""
+        outcomes = []
+
+        def call():
+            try:
+                outcomes.append(self.flights.do(1, lookup, timeout))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=call)]
+        threads[0].start()
+        self.started.wait(5)
+        # count the callers that are waiting, to release them all at once
+        done = self.flights._calls[1].done = CountingEvent()
+        threads.extend(threading.Thread(target=call) for _ in range(followers))
+        for thread in threads[1:]:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while done.waiting < followers and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_concurrent_calls_share_one_lookup(self):
+        outcomes = self.run_concurrently(self.slow_lookup())
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(outcomes, [make_user(1)] * 5)
+        self.assertEqual(self.flights._calls, {})
+
+    def test_error_reaches_every_caller(self):
+        error = ValueError('lookup failed')
+        outcomes = self.run_concurrently(self.slow_lookup(error))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(outcomes, [error] * 5)
+        self.assertEqual(self.flights._calls, {})
+
+    def test_waiter_gives_up_after_timeout(self):
+        def quick_lookup():
+            self.calls += 1
+            return make_user(2)
+
+        lookup = self.slow_lookup()
+        leader = threading.Thread(target=self.flights.do, args=(1, lookup))
+        leader.start()
+        self.started.wait(5)
+        try:
+            self.assertEqual(
+                self.flights.do(1, quick_lookup, timeout=0.01), make_user(2))
+        finally:
+            self.release.set()
+            leader.join(5)
+        self.assertEqual(self.calls, 2)
+
+    def test_sequential_calls_each_look_up(self):
+        self.release.set()
+        self.flights.do(1, self.slow_lookup())
+        self.flights.do(1, self.slow_lookup())
+        self.assertEqual(self.calls, 2)
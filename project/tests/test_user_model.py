@@ -55,6 +55,16 @@ class TestUserModel(BaseTestCase):
 		db.session.add(duplicate_user)
 		self.assertRaises(IntegrityError, db.session.commit)
 
+	def test_add_user_duplicate_email_other_case(self):
+		"""Ensure emails differing only in case raise IntegrityError."""
+		add_user('justatest', 'test@test.com', 'pass')
+		db.session.add(User(
+			username='justanothertest',
+			email='Test@Test.com',
+			password='pass'
+			))
+		self.assertRaises(IntegrityError, db.session.commit)
+
 	def test_passwords_are_random(self):
 		user_one = add_user(
 			username='justatest',
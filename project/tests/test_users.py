@@ -1,7 +1,12 @@
 import json
 import datetime
+from unittest import mock
 
-from project import db
+from flask.json import JSONEncoder
+from sqlalchemy import exc
+from werkzeug.http import http_date
+
+from project import db, replicas, user_cache
 from project.api.models import User
 
 from project.tests.base import BaseTestCase
@@ -12,7 +17,8 @@ class TestUserService(BaseTestCase):
 
     def test_users(self):
         """Ensure the /ping route behaves correctly."""
-        response = self.client.get('/ping')
+        with self.assertMaxQueries(0):
+            response = self.client.get('/ping')
         data = json.loads(response.data.decode())
         self.assertEqual(response.status_code, 200)
         self.assertIn('pong!', data['message'])
@@ -33,20 +39,21 @@ class TestUserService(BaseTestCase):
                 )),
                 content_type='application/json'
             )
-            response = self.client.post(
-                '/users',
-                data = json.dumps(dict(
-                    username='michael',
-                    email='michael@realpython.com',
-                    password='pass'
-                    )),
-                content_type='application/json',
-                headers=dict(
-                    Authorization='Bearer ' + json.loads(
-                        resp_login.data.decode()
-                    )['auth_token']
-                )
-                )
+            with self.assertMaxQueries(3):
+                response = self.client.post(
+                    '/users',
+                    data = json.dumps(dict(
+                        username='michael',
+                        email='michael@realpython.com',
+                        password='pass'
+                        )),
+                    content_type='application/json',
+                    headers=dict(
+                        Authorization='Bearer ' + json.loads(
+                            resp_login.data.decode()
+                        )['auth_token']
+                    )
+                    )
         data = json.loads(response.data.decode())
         self.assertEqual(response.status_code, 201)
         self.assertIn('michael@realpython.com was added!', data['message'])
@@ -165,8 +172,10 @@ class TestUserService(BaseTestCase):
     def test_single_user(self):
         """Ensure get single user behaves correctly."""
         user = add_user(username='michael', email='michael@realpython.com', password='pass')
+        url = f'/users/{user.id}'
         with self.client:
-            response = self.client.get(f'/users/{user.id}')
+            with self.assertMaxQueries(1):
+                response = self.client.get(url)
             data = json.loads(response.data.decode())
             self.assertEqual(response.status_code, 200)
             self.assertTrue('created_at' in data['data'])
@@ -216,14 +225,15 @@ class TestUserService(BaseTestCase):
                 )),
                 content_type='application/json'
             )
-            response = self.client.get(
-                '/users',
-                headers=dict(
-                    Authorization='Bearer ' + json.loads(
-                       resp_login.data.decode()
-                   )['auth_token']
-               )
-            )
+            with self.assertMaxQueries(3):
+                response = self.client.get(
+                    '/users',
+                    headers=dict(
+                        Authorization='Bearer ' + json.loads(
+                           resp_login.data.decode()
+                       )['auth_token']
+                   )
+                )
             data = json.loads(response.data.decode())
             self.assertEqual(response.status_code, 200)
             # michael, fletcher, and the admin
@@ -232,9 +242,10 @@ class TestUserService(BaseTestCase):
             self.assertTrue('created_at' in data['data']['users'][1])
             # michael was created in the past, so he should be second in the list
             self.assertIn('michael', data['data']['users'][2]['username'])
-            self.assertIn('fletcher', data['data']['users'][1]['username'])
+            # fletcher and the admin share created_at; the newer id comes first
+            self.assertIn('fletcher', data['data']['users'][0]['username'])
             self.assertIn('michael@realpython.com', data['data']['users'][2]['email'])
-            self.assertIn('fletcher@realpython.com', data['data']['users'][1]['email'])
+            self.assertIn('fletcher@realpython.com', data['data']['users'][0]['email'])
             self.assertIn('success', data['status'])
 
     def test_add_user_invalid_json_keys_no_password(self):
@@ -321,15 +332,16 @@ class TestUserService(BaseTestCase):
                 content_type='application/json'
             )
             deleteme_user = User.query.filter_by(email='deleteme@deleteme.com').first()
-            response = self.client.delete(
-                '/users/{}'.format(deleteme_user.id),
-                content_type='application/json',
-                headers=dict(
-                    Authorization='Bearer ' + json.loads(
-                    resp_login.data.decode()
-                    )['auth_token']
+            with self.assertMaxQueries(3):
+                response = self.client.delete(
+                    '/users/{}'.format(deleteme_user.id),
+                    content_type='application/json',
+                    headers=dict(
+                        Authorization='Bearer ' + json.loads(
+                        resp_login.data.decode()
+                        )['auth_token']
+                    )
                 )
-            )
             data = json.loads(response.data.decode())
             self.assertTrue(data['status'] == 'success')
             self.assertTrue(data['message'] == 'User deleteme has been deleted.')
@@ -435,19 +447,544 @@ class TestUserService(BaseTestCase):
                 content_type='application/json'
             )
             changeme_user = User.query.filter_by(email='changeme@changeme.com').first()
-            response = self.client.put(
-                '/users/{}'.format(changeme_user.id),
-                content_type='application/json',
+            with self.assertMaxQueries(4):
+                response = self.client.put(
+                    '/users/{}'.format(changeme_user.id),
+                    content_type='application/json',
+                    headers=dict(
+                        Authorization='Bearer ' + json.loads(resp_login.data.decode())['auth_token']
+                    ),
+                    data=json.dumps(dict(
+                        username='xchangeme',
+                        email='changeme@changeme.com',
+                        password='test'
+                    ))
+                )
+        response_data = json.loads(response.data.decode())
+        self.assertEqual(response_data['status'], 'success')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response_data['message'], 'Fields modified: username')
+
+    def test_all_users_paginated(self):
+        """Ensure GET /users pages through users with a cursor."""
+        add_user('admin', 'admin@admin.com', 'admin')
+        user = User.query.filter_by(email='admin@admin.com').first()
+        user.admin = True
+        db.session.commit()
+        now = datetime.datetime.utcnow()
+        for day in range(1, 5):
+            add_user(username='user{}'.format(day),
+                     email='user{}@test.com'.format(day),
+                     password='pass',
+                     created_at=now - datetime.timedelta(days=day))
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='admin@admin.com',
+                    password='admin'
+                )),
+                content_type='application/json'
+            )
+            headers = dict(
+                Authorization='Bearer ' + json.loads(
+                    resp_login.data.decode()
+                )['auth_token']
+            )
+            usernames = []
+            cursor = None
+            pages = 0
+            while True:
+                url = '/users?limit=2'
+                if cursor:
+                    url += '&cursor=' + cursor
+                with self.assertMaxQueries(3):
+                    response = self.client.get(url, headers=headers)
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(len(data['data']['users']), 2)
+                usernames += [u['username'] for u in data['data']['users']]
+                pages += 1
+                cursor = data['data']['next_cursor']
+                if not cursor:
+                    break
+            self.assertEqual(pages, 3)
+            self.assertEqual(
+                usernames[1:], ['user1', 'user2', 'user3', 'user4'])
+
+    def test_all_users_invalid_cursor(self):
+        """Ensure a malformed cursor is rejected."""
+        add_user('admin', 'admin@admin.com', 'admin')
+        user = User.query.filter_by(email='admin@admin.com').first()
+        user.admin = True
+        db.session.commit()
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='admin@admin.com',
+                    password='admin'
+                )),
+                content_type='application/json'
+            )
+            response = self.client.get(
+                '/users?cursor=garbage',
                 headers=dict(
-                    Authorization='Bearer ' + json.loads(resp_login.data.decode())['auth_token']
-                ),
+                    Authorization='Bearer ' + json.loads(
+                        resp_login.data.decode()
+                    )['auth_token']
+                )
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid cursor.', data['message'])
+
+    def test_all_users_stream(self):
+        """Ensure GET /users can stream one user per line."""
+        add_user('admin', 'admin@admin.com', 'admin')
+        user = User.query.filter_by(email='admin@admin.com').first()
+        user.admin = True
+        db.session.commit()
+        add_user('michael', 'michael@realpython.com', 'pass')
+        # streamed responses keep their own request context, so this
+        # test does not hold the client's context open with `with`
+        resp_login = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(
+                email='admin@admin.com',
+                password='admin'
+            )),
+            content_type='application/json'
+        )
+        with self.assertMaxQueries(3):
+            response = self.client.get(
+                '/users',
+                headers={
+                    'Accept': 'application/x-ndjson',
+                    'Authorization': 'Bearer ' + json.loads(
+                        resp_login.data.decode()
+                    )['auth_token']
+                }
+            )
+            lines = response.data.decode().splitlines()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        users = [json.loads(line) for line in lines]
+        self.assertEqual(len(users), 2)
+        self.assertEqual(
+            sorted(u['username'] for u in users), ['admin', 'michael'])
+        self.assertTrue('created_at' in users[0])
+
+    def test_bulk_add_users(self):
+        """Ensure admins can import users from NDJSON with a per-line report."""
+        add_user('admin', 'admin@admin.com', 'admin')
+        user = User.query.filter_by(email='admin@admin.com').first()
+        user.admin = True
+        db.session.commit()
+        lines = [
+            json.dumps(dict(username='one', email='one@test.com', password='pass')),
+            json.dumps(dict(username='two', email='two@test.com', password='pass')),
+            json.dumps(dict(username='admin', email='new@test.com', password='pass')),
+            json.dumps(dict(username='three', email='one@test.com', password='pass')),
+            'not json',
+            json.dumps(dict(username='four', email='four@test.com')),
+        ]
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
                 data=json.dumps(dict(
-                    username='xchangeme',
-                    email='changeme@changeme.com',
-                    password='test'
-                ))
+                    email='admin@admin.com',
+                    password='admin'
+                )),
+                content_type='application/json'
             )
-        response_data = json.loads(response.data.decode())
-        self.assertEqual(response_data['status'], 'success')
+            # the admin, taken names, the INSERT and the new ids
+            with self.assertMaxQueries(4):
+                response = self.client.post(
+                    '/users/bulk',
+                    data='\n'.join(lines),
+                    content_type='application/x-ndjson',
+                    headers=dict(
+                        Authorization='Bearer ' + json.loads(
+                            resp_login.data.decode()
+                        )['auth_token']
+                    )
+                )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data']['created'], 2)
+            self.assertEqual(data['data']['failed'], 4)
+            statuses = [r['status'] for r in data['data']['results']]
+            self.assertEqual(
+                statuses,
+                ['created', 'created', 'error', 'error', 'error', 'error'])
+            self.assertEqual(User.query.count(), 3)
+            user = User.query.filter_by(email='two@test.com').first()
+            self.assertTrue(user.active)
+            self.assertFalse(user.admin)
+
+    def test_bulk_add_users_unsaved_rows(self):
+        """Ensure rows the database would refuse are reported, not a 500."""
+        add_user('admin', 'admin@admin.com', 'admin')
+        user = User.query.filter_by(email='admin@admin.com').first()
+        user.admin = True
+        db.session.commit()
+        resp_login = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(email='admin@admin.com', password='admin')),
+            content_type='application/json'
+        )
+        headers = dict(Authorization='Bearer ' + json.loads(
+            resp_login.data.decode())['auth_token'])
+        lines = [
+            json.dumps(dict(username='x' * 129, email='long@test.com',
+                            password='pass')),
+            json.dumps(dict(username='one', email='one@test.com',
+                            password='pass')),
+        ]
+        error = exc.DataError('INSERT INTO users', {}, Exception('too long'))
+        with mock.patch('project.api.bulk.insert_rows', side_effect=error), \
+                self.assertLogs(self.app.logger, 'WARNING'):
+            response = self.client.post(
+                '/users/bulk', data='\n'.join(lines),
+                content_type='application/x-ndjson', headers=headers)
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [result['message'] for result in data['data']['results']],
+            ['Username or email too long.', 'Could not be saved.'])
+        response = self.client.post(
+            '/users/bulk', data=lines[1],
+            content_type='application/x-ndjson', headers=headers)
+        self.assertEqual(json.loads(response.data.decode())['data']['created'],
+                         1)
+        new_user = User.query.filter_by(username='one').first()
+        self.assertTrue(replicas.wrote_recently(new_user.id))
+
+    def test_bulk_add_users_too_many(self):
+        """Ensure large imports are sent to the manage.py command."""
+        add_user('admin', 'admin@admin.com', 'admin')
+        user = User.query.filter_by(email='admin@admin.com').first()
+        user.admin = True
+        db.session.commit()
+        resp_login = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(email='admin@admin.com', password='admin')),
+            content_type='application/json'
+        )
+        headers = dict(Authorization='Bearer ' + json.loads(
+            resp_login.data.decode())['auth_token'])
+        lines = [json.dumps(dict(
+            username='user{}'.format(number),
+            email='user{}@test.com'.format(number),
+            password='pass')) for number in range(3)]
+        self.app.config['BULK_IMPORT_MAX_ROWS'] = 2
+        try:
+            response = self.client.post(
+                '/users/bulk', data='\n'.join(lines),
+                content_type='application/x-ndjson', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 413)
+            self.assertIn('manage.py import_users', data['message'])
+            self.app.config['BULK_IMPORT_MAX_BYTES'] = 10
+            response = self.client.post(
+                '/users/bulk', data=lines[0],
+                content_type='application/x-ndjson', headers=headers)
+            self.assertEqual(response.status_code, 413)
+        finally:
+            self.app.config['BULK_IMPORT_MAX_ROWS'] = 1000
+            self.app.config['BULK_IMPORT_MAX_BYTES'] = 1024 * 1024
+        self.assertEqual(User.query.count(), 1)
+
+    def test_metrics(self):
+        """Ensure /metrics reports request counts in Prometheus format."""
+        user = add_user('michael', 'michael@realpython.com', 'pass')
+        self.client.get('/ping')
+        self.client.get('/users/{}'.format(user.id))
+        with self.assertMaxQueries(0):
+            response = self.client.get('/metrics')
+        body = response.data.decode()
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response_data['message'], 'Fields modified: username')
\ No newline at end of file
+        self.assertIn('text/plain', response.content_type)
+        self.assertIn(
+            'http_requests_total{endpoint="/users/<user_id>",'
+            'method="GET",status="200"}', body)
+        self.assertIn('http_request_duration_seconds_bucket', body)
+        self.assertIn('db_query_duration_seconds_count', body)
+        self.assertIn('password_hash_duration_seconds_count{operation="hash"}', body)
+
+    def search(self, query, headers):
+        response = self.client.get('/users/search?' + query, headers=headers)
+        return response, json.loads(response.data.decode())
+
+    def admin_headers(self):
+        add_user('admin', 'admin@admin.com', 'admin')
+        user = User.query.filter_by(email='admin@admin.com').first()
+        user.admin = True
+        db.session.commit()
+        resp_login = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(
+                email='admin@admin.com',
+                password='admin'
+            )),
+            content_type='application/json'
+        )
+        return dict(Authorization='Bearer ' + json.loads(
+            resp_login.data.decode())['auth_token'])
+
+    def test_search_users(self):
+        """Ensure search ranks prefix matches above substring matches."""
+        headers = self.admin_headers()
+        add_user('malice', 'malice@test.com', 'pass')
+        add_user('bob', 'bob@alice.org', 'pass')
+        add_user('Alice', 'alice@test.com', 'pass')
+        add_user('carol', 'carol@test.com', 'pass')
+        with self.assertMaxQueries(2):
+            response, data = self.search('q=ALI', headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [user['username'] for user in data['data']['users']],
+            ['Alice', 'bob', 'malice'])
+        self.assertIsNone(data['data']['next_cursor'])
+        # too short for a substring match
+        response, data = self.search('q=al', headers)
+        self.assertEqual(
+            [user['username'] for user in data['data']['users']], ['Alice'])
+        # LIKE wildcards are matched literally
+        response, data = self.search('q=%25', headers)
+        self.assertEqual(data['data']['users'], [])
+
+    def test_search_users_paginated(self):
+        headers = self.admin_headers()
+        for name in ('anna', 'annabel', 'joanna', 'hannah'):
+            add_user(name, name + '@test.com', 'pass')
+        usernames = []
+        cursor = None
+        while True:
+            query = 'q=ann&limit=1'
+            if cursor:
+                query += '&cursor=' + cursor
+            response, data = self.search(query, headers)
+            self.assertEqual(response.status_code, 200)
+            usernames.extend(user['username'] for user in data['data']['users'])
+            cursor = data['data']['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(usernames, ['anna', 'annabel', 'hannah', 'joanna'])
+
+    def test_search_users_invalid(self):
+        headers = self.admin_headers()
+        for query in ('q=', 'q=' + 'a' * 65, 'q=ann&cursor=blah',
+                      'q=ann&limit=0'):
+            response, data = self.search(query, headers)
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn('fail', data['status'])
+
+    def test_search_users_not_admin(self):
+        add_user('test', 'test@test.com', 'test')
+        resp_login = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(
+                email='test@test.com',
+                password='test'
+            )),
+            content_type='application/json'
+        )
+        response, data = self.search('q=test', dict(
+            Authorization='Bearer ' + json.loads(
+                resp_login.data.decode())['auth_token']))
+        self.assertEqual(response.status_code, 401)
+
+    def test_search_users_timeout(self):
+        """Ensure a search running past its time limit is cancelled."""
+        headers = self.admin_headers()
+        created_at = datetime.datetime.utcnow()
+        db.session.execute(User.__table__.insert(), [dict(
+            username='user{}'.format(n), email='user{}@test.com'.format(n),
+            password='x', active=True, admin=False, created_at=created_at)
+            for n in range(500)])
+        db.session.commit()
+        self.app.config['USERS_SEARCH_TIMEOUT_MS'] = 0.001
+        try:
+            response, data = self.search('q=user', headers)
+        finally:
+            self.app.config['USERS_SEARCH_TIMEOUT_MS'] = 500
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('too long', data['message'])
+        response, data = self.search('q=user', headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_single_user_conditional_get(self):
+        """Ensure a current copy of a user is answered with 304."""
+        headers = self.admin_headers()
+        user = add_user('michael', 'michael@realpython.com', 'pass')
+        url = '/users/{}'.format(user.id)
+        response = self.client.get(url)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        with self.assertMaxQueries(1):
+            response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+        response = self.client.get(
+            url, headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+        # modify_user bumps updated_at and with it the ETag
+        response = self.client.put(
+            url,
+            data=json.dumps(dict(
+                username='michael2',
+                email='michael@realpython.com'
+            )),
+            content_type='application/json',
+            headers=headers
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_all_users_conditional_get(self):
+        """Ensure an unchanged listing costs one aggregate query."""
+        headers = self.admin_headers()
+        add_user('michael', 'michael@realpython.com', 'pass')
+        response = self.client.get('/users', headers=headers)
+        etag = response.headers['ETag']
+        self.assertEqual(response.status_code, 200)
+        with self.assertMaxQueries(1):
+            response = self.client.get('/users', headers=dict(
+                headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+        # other pages and formats are other representations
+        response = self.client.get('/users?limit=1', headers=dict(
+            headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        add_user('fletcher', 'fletcher@realpython.com', 'pass')
+        response = self.client.get('/users', headers=dict(
+            headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(
+            response.data.decode())['data']['users']), 3)
+
+    def test_all_users_not_dated(self):
+        """Ensure a deletion is not hidden behind If-Modified-Since."""
+        headers = self.admin_headers()
+        user = add_user('michael', 'michael@realpython.com', 'pass')
+        response = self.client.get('/users', headers=headers)
+        self.assertNotIn('Last-Modified', response.headers)
+        # a date after the newest updated_at, as a client's clock gives it
+        since = http_date(datetime.datetime.utcnow() +
+                          datetime.timedelta(minutes=1))
+        self.client.delete('/users/{}'.format(user.id), headers=headers)
+        response = self.client.get('/users', headers=dict(
+            headers, **{'If-Modified-Since': since}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(
+            response.data.decode())['data']['users']), 1)
+
+    def test_read_paths_skip_password_hash(self):
+        """Ensure the read endpoints never fetch the password column."""
+        headers = self.admin_headers()
+        user = add_user('michael', 'michael@realpython.com', 'pass')
+        urls = ['/users', '/users?limit=1', '/users?stream=1',
+                '/users/search?q=mich', '/users/{}'.format(user.id)]
+        user_cache.clear()
+        with self.assertMaxQueries(20) as counter:
+            for url in urls:
+                response = self.client.get(url, headers=headers)
+                response.get_data()
+                self.assertEqual(response.status_code, 200)
+        self.assertTrue(counter.statements)
+        for statement, _ in counter.statements:
+            self.assertNotIn('password', statement)
+
+    def test_serialized_dates_match_jsonify(self):
+        """Ensure created_at is formatted as jsonify formats datetimes."""
+        created_at = datetime.datetime(2017, 3, 4, 5, 6, 7, 891011)
+        user = add_user('michael', 'michael@realpython.com', 'pass',
+                        created_at=created_at)
+        response = self.client.get('/users/{}'.format(user.id))
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['data']['created_at'],
+                         json.loads(json.dumps(created_at, cls=JSONEncoder)))
+        self.assertEqual(data['data']['created_at'],
+                         'Sat, 04 Mar 2017 05:06:07 GMT')
+
+    def test_all_users_fields(self):
+        """Ensure ?fields= narrows both the SELECT and the response."""
+        headers = self.admin_headers()
+        add_user('michael', 'michael@realpython.com', 'pass')
+        for url in ('/users?fields=id,username',
+                    '/users?fields=username,id&limit=1',
+                    '/users?fields=id,username&stream=1'):
+            with self.assertMaxQueries(3) as counter:
+                response = self.client.get(url, headers=headers)
+                body = response.data.decode()
+            self.assertEqual(response.status_code, 200)
+            if 'stream' in url:
+                users = [json.loads(line) for line in body.splitlines()]
+            else:
+                users = json.loads(body)['data']['users']
+            for user in users:
+                self.assertEqual(set(user), {'id', 'username'})
+            self.assertNotIn('users.email', counter.statements[-1][0])
+        response = self.client.get('/users?fields=id,username&limit=1',
+                                   headers=headers)
+        cursor = json.loads(response.data.decode())['data']['next_cursor']
+        response = self.client.get(
+            '/users?fields=username&limit=1&cursor=' + cursor, headers=headers)
+        self.assertEqual(json.loads(response.data.decode())['data']['users'],
+                         [{'username': 'admin'}])
+
+    def test_invalid_fields(self):
+        """Ensure fields outside the allowlist are rejected."""
+        headers = self.admin_headers()
+        user = add_user('michael', 'michael@realpython.com', 'pass')
+        for url in ('/users?fields=id,password', '/users?fields=',
+                    '/users/{}?fields=admin'.format(user.id),
+                    '/auth/status?fields=updated_at'):
+            response = self.client.get(url, headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(data['message'], 'Invalid fields.')
+
+    def test_single_user_fields(self):
+        """Ensure a single user can be cut down to some fields."""
+        user = add_user('michael', 'michael@realpython.com', 'pass')
+        url = '/users/{}'.format(user.id)
+        # without a user cache to fill, only the fields are read
+        self.app.config['USER_CACHE_BACKEND'] = ''
+        try:
+            with self.assertMaxQueries(1) as counter:
+                response = self.client.get(url + '?fields=username')
+        finally:
+            self.app.config['USER_CACHE_BACKEND'] = 'memory'
+        self.assertNotIn('users.email', counter.statements[0][0])
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['data'], {'username': 'michael'})
+        # another selection is another representation
+        self.assertNotEqual(response.headers['ETag'],
+                            self.client.get(url).headers['ETag'])
+
+    def test_modify_user_email_clash_other_case(self):
+        """Ensure an email may not differ from another only in case."""
+        headers = self.admin_headers()
+        add_user('michael', 'michael@realpython.com', 'pass')
+        user = add_user('fletcher', 'fletcher@realpython.com', 'pass')
+        response = self.client.put(
+            '/users/{}'.format(user.id),
+            data=json.dumps(dict(
+                username='fletcher',
+                email='Michael@RealPython.com'
+            )),
+            content_type='application/json',
+            headers=headers
+        )
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid payload.', data['message'])